@@ -0,0 +1,100 @@
+"""
+Micro-benchmark: tracker_decode() (reference) vs AnchorDecoder.decode().
+
+Recorded outputs are an .npz with
+    delta     : (N, 1, 4A, S, S) float32 regression outputs
+    score     : (N, 1, 2A, S, S) float32 classification outputs
+    target_sz : (N, 2) optional, previous target size per frame (unscaled)
+    scale_z   : (N,)   optional
+Without --outputs, random outputs are generated (timing only).
+
+    python DaSiamRPN/bench_decode.py --outputs recorded_outputs.npz
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from net import SiamRPNvot
+from run_SiamRPN import TrackerConfig, AnchorDecoder, generate_anchor, tracker_decode
+
+
+def make_config():
+    p = TrackerConfig()
+    p.update(SiamRPNvot().cfg)
+    p.score_size = int(p.score_size)
+    p.anchor = generate_anchor(p.total_stride, p.scales, p.ratios, p.score_size)
+    window = np.outer(np.hanning(p.score_size), np.hanning(p.score_size))
+    window = np.tile(window.flatten(), p.anchor_num)
+    return p, window
+
+
+def load_outputs(path, n_synthetic, p):
+    if path:
+        rec = np.load(path)
+        delta, score = rec['delta'].astype(np.float32), rec['score'].astype(np.float32)
+        n = len(delta)
+        target_sz = rec['target_sz'] if 'target_sz' in rec else np.tile([80., 120.], (n, 1))
+        scale_z   = rec['scale_z']   if 'scale_z'   in rec else np.full(n, 0.8)
+        return delta, score, target_sz, scale_z
+
+    rng = np.random.default_rng(0)
+    s = p.score_size
+    delta = rng.normal(0, 0.3, (n_synthetic, 1, 4 * p.anchor_num, s, s)).astype(np.float32)
+    score = rng.normal(0, 2.0, (n_synthetic, 1, 2 * p.anchor_num, s, s)).astype(np.float32)
+    target_sz = np.tile([80., 120.], (n_synthetic, 1))
+    scale_z   = np.full(n_synthetic, 0.8)
+    return delta, score, target_sz, scale_z
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--outputs', help='recorded network outputs (.npz)')
+    parser.add_argument('--synthetic', type=int, default=500, help='frames to generate without --outputs')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top-k', type=int, default=16)
+    args = parser.parse_args()
+
+    p, window = make_config()
+    delta, score, target_sz, scale_z = load_outputs(args.outputs, args.synthetic, p)
+    decoder = AnchorDecoder(p, window, top_k=args.top_k)
+    pos = np.array([256., 256.])
+    n = len(delta)
+
+    # --- agreement ---
+    mismatch = 0
+    for i in range(n):
+        sz = target_sz[i] * scale_z[i]
+        ref = tracker_decode(delta[i].copy(), score[i].copy(), pos, sz, window, scale_z[i], p)
+        new = decoder.decode(delta[i], score[i], pos, sz, scale_z[i])
+        if not (np.allclose(ref[0], new[0], rtol=1e-4) and np.allclose(ref[1], new[1], rtol=1e-4)):
+            mismatch += 1
+
+    # --- timing (copies made up front — tracker_decode writes into delta) ---
+    copies = [(d.copy(), s.copy()) for d, s in zip(delta, score)]
+    best_ref = best_new = float('inf')
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        for i, (d, s) in enumerate(copies):
+            tracker_decode(d, s, pos, target_sz[i] * scale_z[i], window, scale_z[i], p)
+        best_ref = min(best_ref, time.perf_counter() - t0)
+        copies = [(d.copy(), s.copy()) for d, s in zip(delta, score)]
+
+        t0 = time.perf_counter()
+        for i in range(n):
+            decoder.decode(delta[i], score[i], pos, target_sz[i] * scale_z[i], scale_z[i])
+        best_new = min(best_new, time.perf_counter() - t0)
+
+    source = args.outputs or f'synthetic ({n} frames)'
+    print(f"[BENCH] outputs          : {source}")
+    print(f"[BENCH] tracker_decode   : {best_ref / n * 1e6:8.1f} us/frame")
+    print(f"[BENCH] AnchorDecoder    : {best_new / n * 1e6:8.1f} us/frame  (top_k={decoder.top_k})")
+    print(f"[BENCH] speed-up         : {best_ref / best_new:8.2f}x")
+    print(f"[BENCH] box mismatches   : {mismatch}/{n}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Offline, headless benchmark for the DaSiamRPN tracking loop.
+
+Replays recorded sequences through the same stages as SiamRPN_track
+(crop → inference → decode) plus track_live's per-frame bookkeeping
+(post: score smoothing, last-good snapshot / rollback, box) and reports
+per-stage latency
+percentiles, end-to-end FPS and accuracy against ground truth
+(IoU, success / precision curves) for the PyTorch and ONNX paths.
+
+A sequence is either
+  - a directory of frames (sorted by name) with groundtruth_rect.txt or
+    groundtruth.txt inside (OTB / VOT style), or
+  - a video file with a ground-truth file given by --gt or next to it
+    as <video>.txt
+Ground-truth lines are "x,y,w,h" (comma / tab / space separated) or
+8-value polygons. The first box initializes the tracker.
+
+    python DaSiamRPN/benchmark.py seqs/person1 seqs/car.mp4 --backends torch onnx
+"""
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dasiam_tracker import DaSiamRPNTracker, SessionProfile, ORT_AVAILABLE, ONNX_VARIANTS
+from run_SiamRPN import run_net, search_region, update_state
+from utilities import cxy_wh_2_rect, get_axis_aligned_bbox
+from metrics import StageMetrics
+from motion import AdaptiveSkip
+
+STAGES = ['crop', 'inference', 'decode', 'post']
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# ---------------------------------------------------------------
+# SEQUENCE LOADING
+# ---------------------------------------------------------------
+def load_groundtruth(path):
+    boxes = []
+    with open(path) as f:
+        for line in f:
+            values = [float(v) for v in re.split(r'[,\s]+', line.strip()) if v]
+            if not values:
+                continue
+            if len(values) == 8:
+                cx, cy, w, h = get_axis_aligned_bbox(values)
+                values = [cx - w / 2, cy - h / 2, w, h]
+            boxes.append(values[:4])
+    return np.array(boxes, dtype=np.float64)
+
+
+def load_sequence(path, gt_path=None, max_frames=None):
+    """
+    Frames are decoded up front so disk / codec time never shows up
+    in the stage timings.
+    Returns:
+        (name, frames, groundtruth)
+    """
+    frames = []
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTS))
+        for n in names[:max_frames]:
+            frames.append(cv2.imread(os.path.join(path, n)))
+        if gt_path is None:
+            for candidate in ('groundtruth_rect.txt', 'groundtruth.txt'):
+                if os.path.exists(os.path.join(path, candidate)):
+                    gt_path = os.path.join(path, candidate)
+                    break
+    else:
+        cap = cv2.VideoCapture(path)
+        while max_frames is None or len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+        if gt_path is None:
+            gt_path = os.path.splitext(path)[0] + '.txt'
+
+    if not frames:
+        raise RuntimeError(f"No frames found in '{path}'")
+    if gt_path is None or not os.path.exists(gt_path):
+        raise RuntimeError(f"No ground truth found for '{path}'")
+
+    gt = load_groundtruth(gt_path)
+    n = min(len(frames), len(gt))
+    return os.path.basename(os.path.normpath(path)), frames[:n], gt[:n]
+
+
+# ---------------------------------------------------------------
+# ACCURACY
+# ---------------------------------------------------------------
+def overlap_ratio(a, b):
+    """IoU of (N,4) x,y,w,h boxes."""
+    x1 = np.maximum(a[:, 0], b[:, 0])
+    y1 = np.maximum(a[:, 1], b[:, 1])
+    x2 = np.minimum(a[:, 0] + a[:, 2], b[:, 0] + b[:, 2])
+    y2 = np.minimum(a[:, 1] + a[:, 3], b[:, 1] + b[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = a[:, 2] * a[:, 3] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def center_error(a, b):
+    ca = a[:, :2] + a[:, 2:] / 2
+    cb = b[:, :2] + b[:, 2:] / 2
+    return np.linalg.norm(ca - cb, axis=1)
+
+
+def accuracy(pred, gt):
+    iou = overlap_ratio(pred, gt)
+    err = center_error(pred, gt)
+    iou_thresholds = np.linspace(0, 1, 21)
+    px_thresholds  = np.arange(0, 51)
+    success   = np.array([(iou > t).mean() for t in iou_thresholds])
+    precision = np.array([(err <= t).mean() for t in px_thresholds])
+    return {
+        'mean_iou'       : float(iou.mean()),
+        'success_auc'    : float(success.mean()),
+        'precision_20px' : float(precision[20]),
+        'success_curve'  : success.tolist(),
+        'precision_curve': precision.tolist(),
+    }
+
+
+# ---------------------------------------------------------------
+# REPLAY
+# ---------------------------------------------------------------
+def run_sequence(tracker, backend, frames, gt, recorder=None, crop_recorder=None, variant='fp32',
+                 skipper=None, fps=30.0):
+    """
+    Mirrors SiamRPN_track stage by stage so each stage can be timed, then
+    runs tracker.update_confidence() like track_live does.
+    With a motion model (tracker.motion_model) frames go through
+    tracker.step() instead — Kalman-steered crops and, with a skipper,
+    adaptive frame skipping — timestamped at `fps`.
+    Frame 0 initializes from gt[0]; frames 1.. are tracked.
+    Returns:
+        (result dict, predicted boxes (N-1, 4))
+    """
+    tracker.use_onnx = backend == 'onnx'
+    if backend == 'onnx' and tracker.onnx_variant != variant:
+        if tracker.onnx_net is not None:
+            tracker.onnx_net.end_profiling()
+        tracker.onnx_variant = variant
+        tracker.onnx_net     = None   # reopened for the new variant in init_from_box()
+    tracker.init_from_box(frames[0], tuple(gt[0]))
+    state = tracker.state
+    net   = state.net
+    p     = state.p
+
+    if crop_recorder is not None:
+        crop_recorder['r1_kernel'].append(tracker.pt_net.r1_kernel.cpu().numpy())
+        crop_recorder['cls1_kernel'].append(tracker.pt_net.cls1_kernel.cpu().numpy())
+        kernel_idx = len(crop_recorder['r1_kernel']) - 1
+
+    n = len(frames) - 1
+    metrics = StageMetrics(STAGES, capacity=max(1, n))
+    pred    = np.empty((n, 4))
+
+    if skipper is not None:
+        skipper.reset()
+        skipper.total_skipped = 0
+
+    t_start = time.perf_counter()
+    for i, frame in enumerate(frames[1:]):
+        if tracker.motion is not None:
+            _, _, _, skipped = tracker.step(frame, (i + 1) / fps, skipper, metrics)
+            pos = tracker.motion.position if skipped else state.target_pos
+            pred[i] = cxy_wh_2_rect(pos, state.target_sz)
+            continue
+
+        t = time.perf_counter()
+        scale_z, s_x = search_region(p, state.target_sz)
+        x_crop = state.cropper.crop(frame, state.target_pos, round(s_x), state.avg_chans)
+        t = metrics.mark('crop', t)
+        if crop_recorder is not None:
+            crop_recorder['crops'].append(x_crop.copy())
+            crop_recorder['kernel_idx'].append(kernel_idx)
+            t = time.perf_counter()
+        delta, score = run_net(net, x_crop)
+        t = metrics.mark('inference', t)
+        if recorder is not None:
+            recorder.append((delta.copy(), score.copy(), state.target_sz.copy(), scale_z))
+            t = time.perf_counter()
+        np.multiply(state.target_sz, scale_z, out=state.scaled_sz)
+        target_pos, target_sz, s = state.decoder.decode(
+            delta, score, state.target_pos, state.scaled_sz, scale_z,
+            out=(state.target_pos, state.target_sz)
+        )
+        update_state(state, target_pos, target_sz, s)
+        t = metrics.mark('decode', t)
+        tracker.update_confidence(frame.shape[1], frame.shape[0])
+        metrics.mark('post', t)
+        pred[i] = cxy_wh_2_rect(state.target_pos, state.target_sz)
+    total = time.perf_counter() - t_start
+
+    result = {
+        'frames'    : n,
+        'e2e_fps'   : n / total,
+        'latency_ms': metrics.summary(),
+    }
+    if skipper is not None:
+        result['skipped'] = skipper.total_skipped
+    result.update(accuracy(pred, gt[1:]))
+    return result, pred
+
+
+def print_result(name, backend, r):
+    skipped = f" | {r['skipped']} skipped" if 'skipped' in r else ""
+    print(f"\n[BENCH] {name} | {backend} | {r['frames']} frames{skipped} | E2E {r['e2e_fps']:.1f} FPS")
+    for stage in STAGES:
+        lat = r['latency_ms'].get(stage)
+        if lat is None:
+            continue
+        print(f"        {stage:<10} p50 {lat['p50']:7.2f} ms | p95 {lat['p95']:7.2f} ms | p99 {lat['p99']:7.2f} ms")
+    print(f"        IoU {r['mean_iou']:.3f} | success AUC {r['success_auc']:.3f} | precision@20px {r['precision_20px']:.3f}")
+    if 'drift_vs_fp32' in r:
+        d = r['drift_vs_fp32']
+        print(f"        drift vs fp32: box IoU {d['mean_iou_to_fp32']:.3f} | success AUC {d['success_auc_delta']:+.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sequences', nargs='+', help='frame directories or video files')
+    parser.add_argument('--gt', help='ground-truth file (single sequence only)')
+    parser.add_argument('--model', default='models/SiamRPNVOT.model')
+    parser.add_argument('--cache-dir', help='ONNX search-graph cache (default: onnx_cache/ beside --model)')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'], choices=['torch', 'onnx'])
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--json', help='write the full results (incl. curves) here')
+    parser.add_argument('--variants', nargs='+', default=['fp32'], choices=ONNX_VARIANTS,
+                        help='ONNX graph variants to run (non-fp32 are compared against fp32)')
+    parser.add_argument('--ort-threads', type=int, default=0, help='intra-op threads (0 = ORT default)')
+    parser.add_argument('--ort-affinity', type=int, nargs='+', help='cores to pin the intra-op pool to')
+    parser.add_argument('--ort-opt', default='all', choices=SessionProfile.OPT_LEVELS)
+    parser.add_argument('--ort-no-spin', action='store_true', help='disable intra-op thread spinning')
+    parser.add_argument('--ort-no-io-binding', action='store_true')
+    parser.add_argument('--ort-profile', action='store_true', help="write ORT's JSON profile trace")
+    parser.add_argument('--record-outputs', help='save raw network outputs (.npz) for bench_decode.py')
+    parser.add_argument('--record-crops', help='save search crops + kernels (.npz) for quantize_search.py calibration')
+    parser.add_argument('--motion', action='store_true', help='Kalman-steered search crops (tracker.step)')
+    parser.add_argument('--frame-skip', type=int, default=0,
+                        help='adaptive frame skip: up to N frames between network runs (implies --motion)')
+    parser.add_argument('--fps', type=float, default=30.0, help='frame rate the sequences were recorded at')
+    args = parser.parse_args()
+
+    if args.gt and len(args.sequences) > 1:
+        parser.error("--gt only works with a single sequence")
+    args.motion = args.motion or args.frame_skip > 0
+    if args.motion and (args.record_outputs or args.record_crops):
+        parser.error("--record-outputs / --record-crops need the plain path (no --motion / --frame-skip)")
+
+    backends = [b for b in args.backends if b != 'onnx' or ORT_AVAILABLE]
+    profile  = SessionProfile(
+        intra_op_threads=args.ort_threads,
+        affinity=args.ort_affinity,
+        allow_spinning=not args.ort_no_spin,
+        optimization=args.ort_opt,
+        io_binding=not args.ort_no_io_binding,
+        profiling=args.ort_profile,
+    ) if ORT_AVAILABLE else None
+    tracker  = DaSiamRPNTracker(model_path=args.model, use_onnx='onnx' in backends, session_profile=profile,
+                                onnx_cache_dir=args.cache_dir, motion_model=args.motion)
+    skipper  = AdaptiveSkip(max_skip=args.frame_skip) if args.frame_skip > 0 else None
+    recorder = [] if args.record_outputs else None
+    crop_recorder = {'crops': [], 'kernel_idx': [], 'r1_kernel': [], 'cls1_kernel': []} if args.record_crops else None
+
+    # (label, backend, variant) — fp32 first so the other variants can be compared to it
+    variants = sorted(set(args.variants), key=lambda v: v != 'fp32')
+    runs = []
+    for backend in backends:
+        if backend == 'onnx':
+            runs += [('onnx' if v == 'fp32' else f'onnx-{v}', 'onnx', v) for v in variants]
+        else:
+            runs.append((backend, backend, 'fp32'))
+
+    results = {}
+    for path in args.sequences:
+        name, frames, gt = load_sequence(path, args.gt, args.max_frames)
+        if len(frames) < 2:
+            print(f"[WARN] {name}: needs at least 2 frames (init + 1 tracked) — skipped")
+            continue
+        fp32_pred = None
+        for k, (label, backend, variant) in enumerate(runs):
+            first = k == 0
+            r, pred = run_sequence(tracker, backend, frames, gt,
+                                   recorder if first else None,
+                                   crop_recorder if first else None,
+                                   variant, skipper, args.fps)
+            if backend == 'onnx' and variant == 'fp32':
+                fp32_pred = pred
+            elif backend == 'onnx' and fp32_pred is not None:
+                r['drift_vs_fp32'] = {
+                    'mean_iou_to_fp32' : float(overlap_ratio(pred, fp32_pred).mean()),
+                    'success_auc_delta': r['success_auc'] - results[name]['onnx']['success_auc'],
+                }
+            results.setdefault(name, {})[label] = r
+            print_result(name, label, r)
+
+    if tracker.onnx_net is not None:
+        tracker.onnx_net.end_profiling()
+
+    if recorder:
+        np.savez(
+            args.record_outputs,
+            delta=np.stack([r[0] for r in recorder]),
+            score=np.stack([r[1] for r in recorder]),
+            target_sz=np.stack([r[2] for r in recorder]),
+            scale_z=np.array([r[3] for r in recorder]),
+        )
+        print(f"\n[BENCH] Recorded {len(recorder)} network outputs → '{args.record_outputs}'")
+
+    if crop_recorder:
+        np.savez(
+            args.record_crops,
+            crops=np.stack(crop_recorder['crops']),
+            kernel_idx=np.array(crop_recorder['kernel_idx']),
+            r1_kernel=np.stack(crop_recorder['r1_kernel']),
+            cls1_kernel=np.stack(crop_recorder['cls1_kernel']),
+        )
+        print(f"[BENCH] Recorded {len(crop_recorder['crops'])} search crops → '{args.record_crops}'")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"[BENCH] Results written → '{args.json}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+import os
+import time
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+# ---------------------------------------------------------------
+# THREADED FRAME GRABBER
+# ---------------------------------------------------------------
+class FrameGrabber:
+    """
+    Reads frames from a cv2.VideoCapture on its own thread into a small
+    ring buffer. read() always hands back the newest frame; frames that
+    were captured but never read are counted in `dropped`.
+    """
+    def __init__(self, video_src=0, buffer_size=2):
+        """
+        Args:
+            video_src   : anything cv2.VideoCapture accepts (index / path / url)
+            buffer_size : ring buffer length (frames kept in memory)
+        """
+        self.video_src = video_src
+        self.cap = cv2.VideoCapture(video_src)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Cannot open video source: {video_src}")
+
+        # keep the driver-side queue as short as possible — we buffer ourselves
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.buffer       = deque(maxlen=buffer_size)
+        self.cond         = threading.Condition()
+        self.frame_id     = 0      # last id written by the reader thread
+        self.last_read_id = 0      # last id handed to the consumer
+        self.dropped      = 0
+        self.frame_time   = None   # capture timestamp of the last frame returned
+        self.running      = False
+        self.thread       = None
+        self.reader_done  = False   # reader thread has left cap.read() for good
+        self.release_on_exit = False   # stop() gave up waiting — the reader releases cap
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.reader_done = False
+        self.thread  = threading.Thread(target=self._reader, name="FrameGrabber", daemon=True)
+        self.thread.start()
+        return self
+
+    def _reader(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            ts = time.perf_counter()   # capture timestamp, used for E2E latency
+
+            with self.cond:
+                if not ret:
+                    self.running = False
+                    self.cond.notify_all()
+                    break
+                self.frame_id += 1
+                self.buffer.append((self.frame_id, ts, frame))
+                self.cond.notify_all()
+
+        with self.cond:
+            self.reader_done = True
+            release = self.release_on_exit
+        if release:
+            self.cap.release()
+
+    def _has_new_frame(self):
+        return bool(self.buffer) and self.buffer[-1][0] > self.last_read_id
+
+    def read(self, timeout=None):
+        """
+        Blocks until a frame newer than the previously returned one exists.
+        A camera stall (slow first frame, USB renegotiation, exposure
+        settling) just waits longer; ok is False only once the stream has
+        ended (or after `timeout` seconds, if given).
+        Returns:
+            (ok, frame, capture_timestamp)
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self._has_new_frame() or not self.running, timeout)
+            if not self._has_new_frame():
+                return False, None, None
+
+            frame_id, ts, frame = self.buffer[-1]
+            self.dropped     += frame_id - self.last_read_id - 1
+            self.last_read_id = frame_id
+            self.frame_time   = ts
+            return True, frame, ts
+
+    def resync(self):
+        """Marks everything captured so far as seen (e.g. after prompting) — not counted as dropped."""
+        with self.cond:
+            self.last_read_id = self.frame_id
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join(timeout=1.0)
+            # never release the capture under a cap.read() still in progress
+            with self.cond:
+                if not self.reader_done:
+                    self.release_on_exit = True
+                    print("[WARN] Frame grabber still in cap.read() — capture is released when it returns")
+                    return
+        self.cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------------------------------------------------------
+# RECORDED SOURCES — video file, image directory, numpy recording
+# ---------------------------------------------------------------
+class ReplaySource:
+    """
+    Recorded footage behind the same start() / read() / resync() / stop()
+    interface as FrameGrabber, so track_live and the pipeline take either.
+      realtime=True  : frames are released on the recording's clock; a
+                       consumer that falls behind loses frames as it would
+                       on the camera (counted in `dropped`)
+      realtime=False : every frame, as fast as the consumer reads —
+                       deterministic, for profiling and regression runs
+    frame_time is the recording timestamp (index / fps) of the last frame
+    returned; the motion model runs on it, so a replay tracks the same way
+    however fast the machine is.
+    Subclasses implement _read_frame(i) (i never decreases).
+    """
+    def __init__(self, fps=30.0, realtime=True):
+        self.fps        = fps
+        self.realtime   = realtime
+        self.index      = 0      # next frame to return
+        self.dropped    = 0
+        self.frame_time = None
+        self.t0         = None   # perf_counter time of frame 0 on the replay clock
+
+    def start(self):
+        if self.t0 is None:
+            self.resync()
+        return self
+
+    def resync(self):
+        """Restarts the replay clock so the next frame is due now (e.g. after prompting)."""
+        self.t0 = time.perf_counter() - self.index / self.fps
+
+    def read(self, timeout=None):
+        """
+        Returns:
+            (ok, frame, capture_timestamp) — the timestamp is when the frame
+            was due on the replay clock (realtime) or when it was read
+        """
+        self.start()
+        i = self.index
+        if self.realtime:
+            due = self.t0 + i / self.fps
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+            else:
+                # frames whose successor is already due are gone, like on a camera
+                behind = int((now - self.t0) * self.fps) - i
+                if behind > 0:
+                    i += behind
+                    self.dropped += behind
+                    due = self.t0 + i / self.fps
+
+        frame = self._read_frame(i)
+        if frame is None:
+            return False, None, None
+        self.index      = i + 1
+        self.frame_time = i / self.fps
+        return True, frame, due if self.realtime else time.perf_counter()
+
+    def _read_frame(self, i):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class VideoFileSource(ReplaySource):
+    def __init__(self, path, realtime=True, fps=None):
+        """
+        Args:
+            path : video file cv2.VideoCapture can decode
+            fps  : None → the container's frame rate (30 if unknown)
+        """
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Cannot open video file: {path}")
+        super().__init__(fps or self.cap.get(cv2.CAP_PROP_FPS) or 30.0, realtime)
+        self.pos = 0   # next frame the decoder will return
+
+    def _read_frame(self, i):
+        while self.pos < i:
+            # grab() skips the colour conversion of frames nobody will see
+            if not self.cap.grab():
+                return None
+            self.pos += 1
+        ret, frame = self.cap.read()
+        self.pos += 1
+        return frame if ret else None
+
+    def stop(self):
+        self.cap.release()
+
+
+class ImageDirSource(ReplaySource):
+    def __init__(self, path, fps=30.0, realtime=True):
+        """
+        Args:
+            path : directory of frames, played in file-name order
+        """
+        self.files = sorted(
+            os.path.join(path, f) for f in os.listdir(path)
+            if f.lower().endswith(IMAGE_EXTS)
+        )
+        if not self.files:
+            raise RuntimeError(f"No images in: {path}")
+        super().__init__(fps, realtime)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _read_frame(self, i):
+        if i >= len(self.files):
+            return None
+        return cv2.imread(self.files[i])
+
+
+class MemmapSource(ReplaySource):
+    def __init__(self, recording, fps=30.0, realtime=True):
+        """
+        Args:
+            recording : .npy file of (N, H, W, 3) uint8 BGR frames
+                        (np.save / np.lib.format.open_memmap), memory-mapped
+                        so only the frames played are paged in — or an
+                        array of that shape
+        """
+        if isinstance(recording, str):
+            recording = np.load(recording, mmap_mode='r')
+        if recording.ndim != 4 or recording.shape[-1] != 3 or recording.dtype != np.uint8:
+            raise ValueError(f"Expected (N, H, W, 3) uint8 frames, got {recording.shape} {recording.dtype}")
+        self.data = recording
+        super().__init__(fps, realtime)
+
+    def __len__(self):
+        return len(self.data)
+
+    def _read_frame(self, i):
+        if i >= len(self.data):
+            return None
+        return np.array(self.data[i])   # own copy: the mapping is read-only
+
+
+def open_source(src=0, realtime=True, fps=None):
+    """
+    Frame source for a camera index, video file, image directory, .npy
+    recording or stream URL (not started).
+    Args:
+        realtime : recorded sources only — False replays every frame as fast
+                   as it is consumed
+        fps      : recorded sources only — frame rate of image directories /
+                   .npy recordings (default 30), overrides a video's own
+    """
+    if not isinstance(src, str) or src.isdigit():
+        return FrameGrabber(int(src))
+    if os.path.isdir(src):
+        return ImageDirSource(src, fps or 30.0, realtime)
+    if src.endswith('.npy'):
+        return MemmapSource(src, fps or 30.0, realtime)
+    if os.path.isfile(src):
+        return VideoFileSource(src, realtime, fps)
+    return FrameGrabber(src)   # stream URL / device path
+
+
+# ---------------------------------------------------------------
+# DECIMATING FRAME HISTORY
+# ---------------------------------------------------------------
+class FrameHistory:
+    """
+    Bounded, evenly spaced record of the frames since some moment (e.g. a
+    prompt snapshot), however long that moment lasts: when full, every
+    other frame is dropped and the stride doubles. Used to carry a box
+    found on an old snapshot forward to the live frame.
+    """
+    def __init__(self, max_frames=16):
+        self.max_frames = max_frames
+        self.stride     = 1
+        self.count      = 0
+        self.frames     = []   # (frame copy, frame_time)
+
+    def add(self, frame, frame_time):
+        self.count += 1
+        if self.count % self.stride:
+            return
+        # copied: live frames are drawn on by the visualizer
+        self.frames.append((frame.copy(), frame_time))
+        if len(self.frames) > self.max_frames:
+            self.frames = self.frames[1::2]
+            self.stride *= 2
@@ -1,15 +1,24 @@
 import os
 import sys
-import cv2
+import hashlib
+import tempfile
 import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import torch
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))   # utils/
 
-from net import SiamRPNvot
+from net import SiamRPNvot, SiamRPNSearch
 from run_SiamRPN import SiamRPN_init, SiamRPN_track
-from utilities import cxy_wh_2_rect
+from capture import open_source, FrameHistory
+from metrics import StageMetrics
+from visualizer import Visualizer
+from motion import ConstantVelocityKF, AdaptiveSkip
+from reid_gallery import ReIDGallery, embed_crop, embed_target, exemplar_crop, search_frame
+from utils.mask_analysis import mask_stats
 
 torch.set_grad_enabled(False)
 
@@ -20,6 +29,91 @@ except ImportError:
     ORT_AVAILABLE = False
     print("[WARN] onnxruntime not installed — using PyTorch inference")
 
+ONNX_OPSET = 18
+ONNX_VARIANTS = ('fp32', 'fp16', 'int8_dynamic', 'int8_static')
+
+
+# ---------------------------------------------------------------
+# ONNX RUNTIME SESSION PROFILE
+# ---------------------------------------------------------------
+class SessionProfile:
+    """
+    How the search-graph session is built and fed.
+    Args:
+        intra_op_threads : ORT intra-op pool size (0 → ORT default, one per core)
+        inter_op_threads : only used with parallel execution
+        affinity         : cores to pin the intra-op pool to, e.g. [2, 3].
+                           Keep these off the capture / visualizer cores —
+                           on a shared Jetson CPU that contention shows up
+                           as latency jitter. Sets intra_op_threads to
+                           len(affinity) + 1 (ORT's first intra-op thread is
+                           the calling thread itself)
+        parallel         : ORT_PARALLEL instead of ORT_SEQUENTIAL execution
+        allow_spinning   : False → idle pool threads sleep instead of spinning
+                           (less CPU stolen from other threads, slightly
+                           slower wake-up)
+        optimization     : 'disable' | 'basic' | 'extended' | 'all'
+        save_optimized   : serialize the optimized graph next to the cached
+                           one and load that directly on the next start
+        io_binding       : bind preallocated input / output buffers instead
+                           of passing numpy dicts through session.run()
+        profiling        : ORT's built-in profiler — JSON trace written when
+                           the session ends (see _ONNXNet.end_profiling)
+        profile_prefix   : trace file prefix
+    """
+    OPT_LEVELS = ('disable', 'basic', 'extended', 'all')
+
+    def __init__(self,
+                 intra_op_threads=0,
+                 inter_op_threads=0,
+                 affinity=None,
+                 parallel=False,
+                 allow_spinning=True,
+                 optimization='all',
+                 save_optimized=True,
+                 io_binding=True,
+                 profiling=False,
+                 profile_prefix='ort_profile'):
+        if optimization not in self.OPT_LEVELS:
+            raise ValueError(f"Unknown optimization level '{optimization}' — expected one of {self.OPT_LEVELS}")
+        if affinity:
+            intra_op_threads = len(affinity) + 1
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.affinity         = list(affinity) if affinity else None
+        self.parallel         = parallel
+        self.allow_spinning   = allow_spinning
+        self.optimization     = optimization
+        self.save_optimized   = save_optimized
+        self.io_binding       = io_binding
+        self.profiling        = profiling
+        self.profile_prefix   = profile_prefix
+
+    def session_options(self):
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = self.intra_op_threads
+        so.inter_op_num_threads = self.inter_op_threads
+        so.execution_mode = ort.ExecutionMode.ORT_PARALLEL if self.parallel else ort.ExecutionMode.ORT_SEQUENTIAL
+        so.graph_optimization_level = {
+            'disable' : ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            'basic'   : ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            'all'     : ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[self.optimization]
+        if self.affinity:
+            # one entry per pool thread except the caller, ';'-separated
+            so.add_session_config_entry(
+                'session.intra_op_thread_affinities',
+                ';'.join(str(core + 1) for core in self.affinity)   # ORT cores are 1-based
+            )
+        if not self.allow_spinning:
+            so.add_session_config_entry('session.intra_op.allow_spinning', '0')
+            so.add_session_config_entry('session.inter_op.allow_spinning', '0')
+        if self.profiling:
+            so.enable_profiling    = True
+            so.profile_file_prefix = self.profile_prefix
+        return so
+
 
 # ---------------------------------------------------------------
 # ONNX NET WRAPPER
@@ -27,38 +121,108 @@ except ImportError:
 class _ONNXNet:
     """
     Drop-in for SiamRPNvot during track_live().
-    temple() is a no-op — real kernels already baked into the graph.
+    Two graph flavours are supported:
+      - baked  : search_crop is the only input, kernels are constants
+      - cached : r1_kernel / cls1_kernel are graph inputs, set via set_kernels()
+    With profile.io_binding the session reads from / writes into
+    preallocated buffers: write the search crop into input_buffer (or
+    pass any array of the same shape, it is copied there) and note that
+    the returned outputs are overwritten by the next call.
     """
-    def __init__(self, onnx_path):
+    def __init__(self, onnx_path, profile=None, optimized_path=None):
+        """
+        Args:
+            onnx_path      : graph to load
+            profile        : SessionProfile (None → defaults)
+            optimized_path : where to serialize / reuse the optimized graph
+                             (only honoured with profile.save_optimized)
+        """
         self.fps_ema = None
         self.alpha_fps = 0.9
         self.last_model_fps = 0.0
+        self.profile = profile or SessionProfile()
         providers = (
             ['CUDAExecutionProvider', 'CPUExecutionProvider']
             if ORT_AVAILABLE and 'CUDAExecutionProvider' in ort.get_available_providers()
             else ['CPUExecutionProvider']
         )
-        so = ort.SessionOptions()
+        so = self.profile.session_options()
+        if optimized_path and self.profile.save_optimized and self.profile.optimization != 'disable':
+            # the optimized graph is provider / CPU specific — keep one per provider
+            stem, ext = os.path.splitext(optimized_path)
+            optimized_path = f"{stem}.opt_{self.profile.optimization}_{providers[0][:-len('ExecutionProvider')].lower()}{ext}"
+            if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(onnx_path):
+                onnx_path = optimized_path
+                so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL   # already optimized
+            else:
+                so.optimized_model_filepath = optimized_path
         self.session    = ort.InferenceSession(onnx_path,sess_options=so, providers=providers)
         self.input_name = self.session.get_inputs()[0].name
-        print(f"[INFO] ONNX session loaded | provider: {self.session.get_providers()[0]}")
+        self.kernel_inputs = len(self.session.get_inputs()) == 3
+        self.feed = {}
+        self.profiling = self.profile.profiling
+
+        # IO binding needs static shapes to preallocate against
+        self.binding      = None
+        self.input_buffer = None
+        shapes = [a.shape for a in self.session.get_inputs() + self.session.get_outputs()]
+        if self.profile.io_binding and all(isinstance(d, int) for shape in shapes for d in shape):
+            self._bind_buffers()
+        print(f"[INFO] ONNX session loaded | provider: {self.session.get_providers()[0]} | "
+              f"graph: {os.path.basename(onnx_path)} | io_binding: {self.binding is not None}")
+
+    def _bind_buffers(self):
+        self.binding = self.session.io_binding()
+        self.buffers = {}
+        for arg in self.session.get_inputs():
+            self.buffers[arg.name] = np.zeros(arg.shape, np.float32)
+            self.binding.bind_ortvalue_input(arg.name, ort.OrtValue.ortvalue_from_numpy(self.buffers[arg.name]))
+        self.outputs = []
+        for arg in self.session.get_outputs():
+            out = np.empty(arg.shape, np.float32)
+            self.outputs.append(out)
+            self.binding.bind_ortvalue_output(arg.name, ort.OrtValue.ortvalue_from_numpy(out))
+        self.input_buffer = self.buffers[self.input_name]
+
+    def set_kernels(self, r1_kernel, cls1_kernel):
+        """Feed new template kernels — no export, no session rebuild."""
+        if not self.kernel_inputs:
+            raise RuntimeError("ONNX graph has baked kernels — re-export to change target")
+        self.feed['r1_kernel']   = np.ascontiguousarray(r1_kernel.detach().cpu().numpy(), dtype=np.float32)
+        self.feed['cls1_kernel'] = np.ascontiguousarray(cls1_kernel.detach().cpu().numpy(), dtype=np.float32)
+        if self.binding is not None:
+            np.copyto(self.buffers['r1_kernel'], self.feed['r1_kernel'])
+            np.copyto(self.buffers['cls1_kernel'], self.feed['cls1_kernel'])
 
     def __call__(self, x_crop):
-        x_np = x_crop if x_crop.dtype == np.float32 else x_crop.astype(np.float32)
-
         t0 = time.perf_counter()   # ✅ model timing start
 
-        regression, classification = self.session.run(
-            None, {self.input_name: x_np}
-        )
+        if self.binding is not None:
+            if x_crop is not self.input_buffer:
+                np.copyto(self.input_buffer, x_crop)
+            self.session.run_with_iobinding(self.binding)
+            regression, classification = self.outputs
+        else:
+            x_np = x_crop if x_crop.dtype == np.float32 else x_crop.astype(np.float32)
+            self.feed[self.input_name] = x_np
+            regression, classification = self.session.run(None, self.feed)
 
         dt = time.perf_counter() - t0
         self.last_model_fps = 1.0 / dt   # ✅ store model FPS
 
         return regression, classification
 
+    def end_profiling(self):
+        """Stops ORT profiling and returns the trace path (None if profiling is off)."""
+        if not self.profiling:
+            return None
+        path = self.session.end_profiling()
+        self.profiling = False
+        print(f"[INFO] ORT profile written → '{path}'")
+        return path
+
     def temple(self, z):
-        pass   # no-op — kernels already baked in
+        pass   # no-op — kernels are baked in or fed via set_kernels()
 
     cfg = {}
 
@@ -70,18 +234,47 @@ class DaSiamRPNTracker:
     def __init__(self,
                  model_path='models/SiamRPNVOT.model',
                  onnx_path='search.onnx',
-                 use_onnx=True):
+                 use_onnx=True,
+                 onnx_cache_dir=None,
+                 bake_kernels=False,
+                 onnx_variant='fp32',
+                 session_profile=None,
+                 motion_model=True,
+                 reid=True):
         """
         Args:
-            model_path : PyTorch .model weights
-            onnx_path  : where to save/load search.onnx
-            use_onnx   : False → pure PyTorch the whole way
+            model_path     : PyTorch .model weights
+            onnx_path      : where to save/load search.onnx (bake_kernels only)
+            use_onnx       : False → pure PyTorch the whole way
+            onnx_cache_dir : where kernel-input search graphs are cached
+                             (None → onnx_cache/ beside model_path)
+            bake_kernels   : True → legacy mode, re-export with constant kernels
+                             on every init_from_mask()
+            onnx_variant   : one of ONNX_VARIANTS — non-FP32 variants are
+                             built by quantize_search.py
+            session_profile: SessionProfile for the ONNX Runtime session
+                             (threads, core affinity, optimization,
+                             IO binding, profiling) — None → defaults
+            motion_model   : constant-velocity Kalman filter that centres the
+                             search crop on the predicted position (needed
+                             for frame skipping and controller velocity)
+            reid           : appearance gallery of the target (featureExtract
+                             embeddings of confident frames) — once the track
+                             is lost, the whole frame is searched against it
+                             before falling back to the re-detector
         """
         self.model_path = model_path
         self.fps_ema = None
         self.alpha_fps = 0.9
         self.onnx_path  = onnx_path
         self.use_onnx   = use_onnx and ORT_AVAILABLE
+        self.onnx_cache_dir = onnx_cache_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), 'onnx_cache')
+        self.bake_kernels   = bake_kernels
+        self.onnx_variant   = onnx_variant
+        self.session_profile = session_profile or (SessionProfile() if ORT_AVAILABLE else None)
+        self._weights_digest = None
+        if onnx_variant not in ONNX_VARIANTS:
+            raise ValueError(f"Unknown ONNX variant '{onnx_variant}' — expected one of {ONNX_VARIANTS}")
         self.device     = torch.device('cuda' if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available()  else 'cpu')
 
         # always load PyTorch net — needed for temple() during init
@@ -90,12 +283,33 @@ class DaSiamRPNTracker:
         self.pt_net.eval().to(self.device)
         print(f"[INFO] PyTorch model loaded | device: {self.device}")
 
-        # onnx_net stays None until init_from_mask() exports with real kernels
+        # onnx_net stays None until the first init_from_mask()
         self.onnx_net        = None
-        self.state           = None
-        self.last_good_state = None
+        self.state           = None   # run_SiamRPN.TrackerState
         self.score_ema       = None
         self.alpha           = 0.7
+        self.conf_thresh     = 0.35   # smoothed score below this → weak frame
+        self.motion_model    = motion_model
+        self.motion          = None   # motion.ConstantVelocityKF, reset per target
+
+        # re-identification: gallery filled on confident frames, searched when lost
+        self.gallery         = ReIDGallery() if reid else None
+        self.reid_interval   = 0.5    # s between gallery updates
+        self.reid_add_score  = 0.8    # smoothed score needed to add to the gallery
+        self.reid_match      = 0.85   # cosine similarity that counts as the target
+        self._reid_t         = None   # frame time of the last gallery update
+        self._reid_pool      = None   # one worker thread, started on first use
+        self._reid_future    = None   # search in flight → (centre, similarity, seconds)
+        self._reid_embed     = None   # gallery update in flight → (embedding, seconds)
+
+        # per-stage timings of track_live(); export with metrics.MetricsExporter
+        self.metrics         = StageMetrics()
+
+        # request_snapshot() / retarget() hand-off into a running track_live()
+        self._target_lock      = threading.Lock()
+        self._target_set       = threading.Condition(self._target_lock)
+        self._snapshot_request = None   # (Future, keep history)
+        self._pending_target   = None   # (frame, mask, box, prompt), () = cancelled
 
     # -----------------------------------------------------------
     # INTERNAL — export search.onnx AFTER real temple() has run
@@ -119,163 +333,614 @@ class DaSiamRPNTracker:
                 self.onnx_path,
                 input_names=['search_crop'],
                 output_names=['regression', 'classification'],
-                opset_version=18,
+                opset_version=ONNX_OPSET,
                 do_constant_folding=True,   # bakes REAL r1_kernel/cls1_kernel
             )
 
         print(f"[INFO] Exported → '{self.onnx_path}'")
-        self.onnx_net = _ONNXNet(self.onnx_path)
+        self.onnx_net = _ONNXNet(self.onnx_path, self.session_profile)
+
+    # -----------------------------------------------------------
+    # KERNEL-INPUT SEARCH GRAPH — cached per weights file
+    # -----------------------------------------------------------
+    def search_graph_path(self, variant='fp32'):
+        """
+        Cache key = hash of the weights file + opset, so the graph is
+        rebuilt only when the model itself changes. Optimized variants
+        (see quantize_search.py) sit next to it with a suffix.
+        """
+        if self._weights_digest is None:
+            digest = hashlib.sha256()
+            with open(self.model_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            self._weights_digest = digest.hexdigest()[:16]
+
+        suffix = '' if variant == 'fp32' else f'_{variant}'
+        name = f"search_{self._weights_digest}_op{ONNX_OPSET}{suffix}.onnx"
+        return os.path.join(self.onnx_cache_dir, name)
+
+    def export_search_graph(self):
+        """
+        Exports the search branch with r1_kernel / cls1_kernel as graph
+        inputs, unless it is already cached. Returns the FP32 graph path.
+        """
+        graph_path = self.search_graph_path()
+        if os.path.exists(graph_path):
+            return graph_path
+
+        print(f"[INFO] Building kernel-input search graph → '{graph_path}' ...")
+        os.makedirs(self.onnx_cache_dir, exist_ok=True)
+
+        # export under the final file name in a scratch dir, then move —
+        # never leave a half-written cache entry (newer exporters may
+        # also write a '<name>.data' weights file next to the graph)
+        tmp_dir  = tempfile.mkdtemp(dir=self.onnx_cache_dir)
+        tmp_path = os.path.join(tmp_dir, os.path.basename(graph_path))
+
+        dummy_x = torch.zeros(1, 3, 271, 271).to(self.device)
+        with torch.no_grad():
+            # kernel values don't matter (they are inputs) — only their shapes
+            dummy_z = torch.zeros(1, 3, 127, 127).to(self.device)
+            r1_kernel, cls1_kernel = self.pt_net.template_kernels(dummy_z)
+            torch.onnx.export(
+                SiamRPNSearch(self.pt_net).eval(),
+                (dummy_x, r1_kernel, cls1_kernel),
+                tmp_path,
+                input_names=['search_crop', 'r1_kernel', 'cls1_kernel'],
+                output_names=['regression', 'classification'],
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True,
+            )
+        for name in sorted(os.listdir(tmp_dir), key=lambda n: n.endswith('.onnx')):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.onnx_cache_dir, name))
+        os.rmdir(tmp_dir)
+        return graph_path
+
+    def _load_search_graph(self):
+        """Opens one session for the selected graph variant."""
+        if self.onnx_variant == 'fp32':
+            graph_path = self.export_search_graph()
+        else:
+            graph_path = self.search_graph_path(self.onnx_variant)
+            if not os.path.exists(graph_path):
+                raise RuntimeError(
+                    f"ONNX variant '{self.onnx_variant}' not built — "
+                    f"run DaSiamRPN/quantize_search.py --model {self.model_path}"
+                )
+        print(f"[INFO] Using search graph '{graph_path}'")
+        self.onnx_net = _ONNXNet(graph_path, self.session_profile, optimized_path=graph_path)
 
     # -----------------------------------------------------------
     # INIT FROM MASK
     # -----------------------------------------------------------
-    def init_from_mask(self, rgb_frame, mask):
+    def init_from_mask(self, frame, mask, new_target=True):
         """
         Args:
-            rgb_frame : HxWxC numpy BGR
-            mask      : HxW binary (255 or True = object pixels)
+            frame : HxWxC numpy BGR, native resolution — the geometry
+                    track_live will see
+            mask  : binary (255 or True = object pixels), either HxW or at
+                    the segmentation resolution (e.g. 512x512); the box of
+                    its largest component is mapped to the frame geometry
+                    once, here
+            new_target : False → re-acquisition of the same target: its
+                    re-ID gallery is kept
         Returns:
-            (x_min, y_min, w, h)
+            (x_min, y_min, w, h) in frame coordinates
         """
-        if rgb_frame is None or mask is None:
-            raise ValueError("rgb_frame and mask are required")
+        if frame is None or mask is None:
+            raise ValueError("frame and mask are required")
 
-        ys, xs = np.where(mask > 0)
-        if len(xs) == 0:
+        stats = mask_stats(mask)
+        if stats is None:
             raise ValueError("Mask is empty — nothing to track")
 
-        x_min, x_max = int(xs.min()), int(xs.max())
-        y_min, y_max = int(ys.min()), int(ys.max())
+        x_min, y_min, w, h = stats.box
+        x_max, y_max = x_min + w, y_min + h
+
+        # segmentation frame → native frame (per-axis: the 512x512 resize
+        # does not keep the aspect ratio)
+        sx = frame.shape[1] / mask.shape[1]
+        sy = frame.shape[0] / mask.shape[0]
+        x_min, x_max = int(x_min * sx), int(x_max * sx)
+        y_min, y_max = int(y_min * sy), int(y_max * sy)
         w  = max(10, x_max - x_min)
         h  = max(10, y_max - y_min)
-        cx = x_min + w / 2
-        cy = y_min + h / 2
 
-        target_pos = np.array([cx, cy])
-        target_sz  = np.array([w,  h])
+        return self.init_from_box(frame, (x_min, y_min, w, h), new_target)
+
+    # -----------------------------------------------------------
+    # INIT FROM BOX
+    # -----------------------------------------------------------
+    def init_from_box(self, frame, box, new_target=True):
+        """
+        Args:
+            frame      : HxWxC numpy BGR
+            box        : (x_min, y_min, w, h)
+            new_target : False → keep the re-ID gallery (same target)
+        Returns:
+            (x_min, y_min, w, h)
+        """
+        x_min, y_min, w, h = box
+        target_pos = np.array([x_min + w / 2, y_min + h / 2])
+        target_sz  = np.array([w,  h], dtype=np.float64)
 
         # SiamRPN_init internally calls pt_net.temple(real_z_crop)
         # after this line r1_kernel and cls1_kernel are REAL
-        self.state           = SiamRPN_init(rgb_frame, target_pos, target_sz, self.pt_net)
-        self.last_good_state = self.state.copy()
+        self.state           = SiamRPN_init(frame, target_pos, target_sz, self.pt_net)
         self.score_ema       = None
+        if self.motion_model:
+            self.motion = ConstantVelocityKF()
+            self.motion.reset(target_pos)   # clock starts at the first tracked frame
 
-        # export NOW — kernels are real at this exact point
         if self.use_onnx:
-            self._export_with_real_kernels()
+            if self.bake_kernels:
+                # export NOW — kernels are real at this exact point
+                self._export_with_real_kernels()
+            else:
+                # graph + session are built once; re-targeting only feeds new kernels
+                if self.onnx_net is None:
+                    self._load_search_graph()
+                self.onnx_net.set_kernels(self.pt_net.r1_kernel, self.pt_net.cls1_kernel)
+
+            # crop straight into the session's bound input — no per-frame copy
+            cropper = self.state.cropper
+            if self.onnx_net.input_buffer is not None and self.onnx_net.input_buffer.shape == cropper.buffer.shape:
+                cropper.buffer = self.onnx_net.input_buffer
+
+        self.state.net = self.onnx_net if (self.use_onnx and self.onnx_net) else self.pt_net
+
+        if self.gallery is not None:
+            if new_target:
+                self.gallery.clear()
+            if self._reid_embed is not None:
+                self._reid_embed.cancel()   # crop of the previous track — never added
+                self._reid_embed = None
+            self.gallery.add(embed_target(self.pt_net, frame, self.state))   # first entry is pinned
+            self._reid_t = None
+            self.reid_cancel()   # a search still running was for the previous track
 
         print(f"[INFO] Tracker initialized | box: ({x_min},{y_min},{w},{h})")
         return (x_min, y_min, w, h)
 
     # -----------------------------------------------------------
-    # LIVE TRACKING
+    # PER-FRAME CONFIDENCE BOOKKEEPING
+    # -----------------------------------------------------------
+    def update_confidence(self, frame_w, frame_h):
+        """
+        Runs after SiamRPN_track(): smooths the score, then snapshots the
+        state on a good frame or rolls back to the last good one on a
+        weak frame (both in place, no allocation).
+        Returns:
+            ((x, y, w, h) ints clamped to the frame, smoothed score, weak)
+        """
+        state = self.state
+        if self.score_ema is None:
+            self.score_ema = state.score
+        else:
+            self.score_ema = self.alpha * self.score_ema + (1 - self.alpha) * state.score
+
+        weak = self.score_ema < self.conf_thresh
+        if weak:
+            state.restore()
+        else:
+            state.snapshot()
+
+        return self._box(state.target_pos, state.target_sz, frame_w, frame_h), self.score_ema, weak
+
+    @staticmethod
+    def _box(pos, sz, frame_w, frame_h):
+        w = int(sz[0])
+        h = int(sz[1])
+        x = max(0, min(int(pos[0] - sz[0] / 2), frame_w - w))
+        y = max(0, min(int(pos[1] - sz[1] / 2), frame_h - h))
+        return (x, y, w, h)
+
+    @property
+    def velocity(self):
+        """Smoothed target velocity (vx, vy) in px/s, (0, 0) without a motion model."""
+        return self.motion.velocity if self.motion is not None else (0.0, 0.0)
+
+    # -----------------------------------------------------------
+    # ONE FRAME
+    # -----------------------------------------------------------
+    def step(self, frame, t, skipper=None, metrics=None):
+        """
+        Tracks one frame: motion prediction → (maybe skip) → crop centred on
+        the prediction → SiamRPN_track → confidence bookkeeping → filter update.
+        Args:
+            frame   : HxWxC BGR, same geometry as at init
+            t       : capture timestamp in seconds
+            skipper : optional motion.AdaptiveSkip — on skipped frames the
+                      box is the Kalman prediction and the network is not run
+            metrics : StageMetrics to record into (default self.metrics)
+        Returns:
+            ((x, y, w, h), smoothed score, weak, skipped)
+        """
+        metrics = self.metrics if metrics is None else metrics
+        frame_h, frame_w = frame.shape[:2]
+        state  = self.state
+        motion = self.motion
+
+        if motion is not None:
+            pred = motion.predict(t)
+            if skipper is not None and skipper.should_skip():
+                return self._box(pred, state.target_sz, frame_w, frame_h), self.score_ema, False, True
+            if not motion.coasting(t):
+                np.copyto(state.target_pos, pred)   # steer the search crop
+
+        SiamRPN_track(state, frame, metrics)
+
+        t0 = time.perf_counter()
+        box, score, weak = self.update_confidence(frame_w, frame_h)
+        if motion is not None:
+            nis = 0.0 if weak else motion.update(state.target_pos, state.score)
+            if skipper is not None:
+                skipper.observe(score, nis, weak)
+        metrics.mark('post', t0)
+
+        if self.gallery is not None:
+            self._reid_take_embed(metrics)
+            if (not weak and score >= self.reid_add_score
+                    and (self._reid_t is None or t - self._reid_t >= self.reid_interval)):
+                # only the crop is taken here — featureExtract runs on the
+                # re-ID worker, the embedding is added on a later step()
+                self._reid_take_embed(metrics, wait=True)   # one in flight, added in order
+                self._reid_embed = self._reid_worker().submit(self._reid_embed_crop, exemplar_crop(frame, state))
+                self._reid_t = t
+        return box, score, weak, False
+
+    # -----------------------------------------------------------
+    # RE-IDENTIFICATION
     # -----------------------------------------------------------
-    def track_live(self, video_src=0, display=True):
+    def _reid_worker(self):
+        if self._reid_pool is None:
+            self._reid_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ReID")
+        return self._reid_pool
+
+    def _reid_embed_crop(self, z):
+        t0 = time.perf_counter()
+        return embed_crop(self.pt_net, z), time.perf_counter() - t0
+
+    def _reid_take_embed(self, metrics, wait=False):
+        """Adds the finished gallery update, if any (wait → block until it is)."""
+        future = self._reid_embed
+        if future is None or not (wait or future.done()):
+            return
+        self._reid_embed = None
+        try:
+            embedding, elapsed = future.result()
+        except Exception as e:
+            print(f"[WARN] Re-ID gallery update failed: {e!r}")
+            return
+        self.gallery.add(embedding)
+        metrics.record('reid', elapsed)
+
+    def reid_submit(self, frame):
         """
-        Yields (x, y, w, h) every frame.
+        Starts a whole-frame search for the target's appearance (one
+        featureExtract pass, see reid_gallery.search_frame) on the re-ID
+        worker thread; tracking goes on meanwhile, reid_poll() picks the
+        result up. The search runs on a copy of the frame and of the
+        gallery (with any gallery update in flight added first). Ignored
+        while a search is in flight.
+        Returns:
+            True if a search was started
+        """
+        if self.gallery is None or not len(self.gallery):
+            return False
+        if self._reid_future is not None and not self._reid_future.done():
+            return False
+        self._reid_take_embed(self.metrics, wait=True)
+        self._reid_future = self._reid_worker().submit(
+            self._reid_search, frame.copy(), self.state.p, self.state.target_sz.copy(), self.gallery.copy()
+        )
+        return True
+
+    def _reid_search(self, frame, p, target_sz, gallery):
+        # runs on the worker: the time goes back with the result and is
+        # recorded by reid_poll() on the tracking thread
+        t0 = time.perf_counter()
+        embeddings, centres = search_frame(self.pt_net, frame, p, target_sz)
+        sims = gallery.match(embeddings)
+        best = int(np.argmax(sims))
+        return centres[best], float(sims[best]), time.perf_counter() - t0
+
+    def reid_poll(self, frame_w, frame_h, wait=False):
+        """
+        Applies a finished search: on a match the tracker moves to it — the
+        size is kept, the next step() refines it.
+        Args:
+            wait : block until the search in flight finishes (deterministic
+                   replays) instead of leaving it for a later frame
+        Returns:
+            ((x, y, w, h), similarity) on a match, else None
+        """
+        future = self._reid_future
+        if future is None or not (wait or future.done()):
+            return None
+        self._reid_future = None
+        try:
+            centre, sim, elapsed = future.result()
+        except Exception as e:
+            print(f"[WARN] Re-ID search failed: {e!r}")
+            return None
+        self.metrics.record('reid', elapsed)
+        if sim < self.reid_match:
+            return None
+
+        state = self.state
+        np.copyto(state.target_pos, centre)
+        state.snapshot()   # a weak frame rolls back to here, not to where it was lost
+        self.score_ema = None
+        if self.motion is not None:
+            self.motion.reset(state.target_pos)
+        return self._box(state.target_pos, state.target_sz, frame_w, frame_h), sim
+
+    def reid_cancel(self):
+        """Drops the search in flight (its result is never applied)."""
+        if self._reid_future is not None:
+            self._reid_future.cancel()
+            self._reid_future = None
+
+    # -----------------------------------------------------------
+    # RE-TARGETING (from other threads, while track_live runs)
+    # -----------------------------------------------------------
+    def request_snapshot(self, history=True):
+        """
+        Asks the running track_live loop for a copy of its next frame, to
+        prompt / segment on while tracking continues. With history, the
+        frames after it are kept (decimated, see capture.FrameHistory) so a
+        target found on the snapshot is tracked forward to the live frame.
+        Returns:
+            Future → (frame copy, frame_time)
         """
-        if self.state is None:
-            raise RuntimeError("Call init_from_mask() before track_live()")
+        future = Future()
+        with self._target_lock:
+            self._snapshot_request = (future, history)
+        return future
 
-        # use ONNX net if exported, else fall back to PyTorch
-        active_net = self.onnx_net if (self.use_onnx and self.onnx_net) else self.pt_net
-        mode_label = 'ONNX' if (self.use_onnx and self.onnx_net) else 'PyTorch'
+    def retarget(self, frame, mask=None, box=None, prompt=None):
+        """
+        Hands a new target to the running track_live loop, which applies it
+        before its next frame. frame is the snapshot the mask / box were
+        found on (request_snapshot()); give exactly one of mask / box.
+        prompt (redetect.Prompt) replaces the re-detector's prompt.
+        """
+        if (mask is None) == (box is None):
+            raise ValueError("retarget() needs exactly one of mask / box")
+        with self._target_lock:
+            self._pending_target = (frame, mask, box, prompt)
+            self._target_set.notify_all()
+
+    def cancel_snapshot(self):
+        """The last snapshot led to no target — stop keeping history / waiting for it."""
+        with self._target_lock:
+            self._pending_target = ()
+            self._target_set.notify_all()
+
+    def _take_pending_target(self, wait):
+        with self._target_lock:
+            if wait:
+                self._target_set.wait_for(lambda: self._pending_target is not None, timeout=0.1)
+            pending, self._pending_target = self._pending_target, None
+            return pending
+
+    def _apply_target(self, pending, history, redetector):
+        frame, mask, box, prompt = pending
+        x, y, w, h = self.init_from_box(frame, box) if box is not None else self.init_from_mask(frame, mask)
+        # carry the box from the snapshot forward through the frames seen since
+        if history is not None and history.frames:
+            t = time.perf_counter()
+            for past, frame_time in history.frames:
+                (x, y, w, h), _, _, _ = self.step(past, frame_time)
+            print(f"[INFO] Target carried forward over {len(history.frames)} frames "
+                  f"in {(time.perf_counter() - t) * 1000:.0f}ms")
+        if redetector is not None:
+            redetector.cancel()
+            if prompt is not None:
+                redetector.prompt = prompt
+        return (x, y, w, h)
 
-        cap = cv2.VideoCapture(video_src)
-        if not cap.isOpened():
-            raise RuntimeError(f"Cannot open video source: {video_src}")
+    # -----------------------------------------------------------
+    # LIVE TRACKING
+    # -----------------------------------------------------------
+    def track_live(self, video_src=0, display=True, display_fps=15, redetector=None, frame_skip=0,
+                   block_on_retarget=False):
+        """
+        Yields (x, y, w, h) every frame, or None while there is no target
+        (see .velocity for the smoothed target velocity to send along).
+        The source keeps streaming the whole time: without a target the
+        loop idles on the live view, and request_snapshot() / retarget()
+        from another thread switch targets without stopping it.
+        Args:
+            video_src   : camera index / video file / image directory / .npy
+                          recording / URL (opened with capture.open_source
+                          and closed at the end), or an already open source
+                          — e.g. the one the prompt frame came from — which
+                          is resynced and left open for the caller
+            display     : False → headless, no HighGUI calls at all; or an
+                          already started Visualizer (e.g. shared with a
+                          prompt UI), which is left running for the caller
+            display_fps : max render rate of the visualizer thread
+            redetector  : optional started redetect.Redetector — once the
+                          target is lost it re-runs the original prompt in
+                          the background and re-initializes on a hit
+            frame_skip  : > 0 → adaptive frame skip: while the track is
+                          stable, run the network only every
+                          (frame_skip + 1)th frame and bridge the rest with
+                          the motion model (needs motion_model=True)
+            block_on_retarget : True → after handing out a snapshot, wait
+                          for its retarget() before reading on, and apply a
+                          re-ID search on the frame after the one it was
+                          started on (as-fast-as-possible replays stay
+                          deterministic)
+        """
+        # frames are tracked at native resolution: only the search patch is
+        # scaled (inside the crop), never the whole frame
+        mode_label = 'ONNX' if self.use_onnx else 'PyTorch'
+
+        # camera I/O runs on its own thread — the loop always gets the newest frame;
+        # recorded sources replay on their own clock (or as fast as possible)
+        owns_source = not hasattr(video_src, 'read')
+        grabber = open_source(video_src) if owns_source else video_src
+        grabber.start()
+        grabber.resync()   # frames that arrived while prompting are not "dropped"
+        owns_visualizer = not hasattr(display, 'submit')
+        if owns_visualizer:
+            visualizer = Visualizer(max_fps=display_fps).start() if display else None
+        else:
+            visualizer = display
+        skipper = AdaptiveSkip(max_skip=frame_skip) if frame_skip and self.motion_model else None
 
-        SCREEN_W    = 512
-        SCREEN_H    = 512
-        CONF_THRESH = 0.35
         MAX_LOST    = 15
+        REID_EVERY  = 5       # lost frames between re-ID searches
         lost_count  = 0
+        reid_wait   = 0       # lost frames until the next re-ID search
+        history     = None    # frames since the last snapshot handed out
+        awaiting    = False   # snapshot out, retarget not back yet
 
         print(f"[INFO] Tracking started | mode: {mode_label}")
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.resize(frame, (SCREEN_W, SCREEN_H))
-
-            # ✅ START TIMER (correct place)
-            t0 = time.perf_counter()
-
-            # ---------------- TRACKING ----------------
-            self.state['net'] = active_net
-            self.state        = SiamRPN_track(self.state, frame)
-
-            raw_score = float(self.state.get('score', 1.0))
-            if self.score_ema is None:
-                self.score_ema = raw_score
-            else:
-                self.score_ema = self.alpha * self.score_ema + (1 - self.alpha) * raw_score
-
-            score = self.score_ema
-            weak  = score < CONF_THRESH
-
-            x, y, w, h = map(
-                int,
-                cxy_wh_2_rect(self.state['target_pos'], self.state['target_sz'])
-            )
-            x = max(0, min(x, SCREEN_W - w))
-            y = max(0, min(y, SCREEN_H - h))
-
-            if weak:
-                lost_count += 1
-                print(f"[WARN] Weak | score={score:.2f} | lost={lost_count}/{MAX_LOST}")
-                if self.last_good_state is not None:
-                    self.state = self.last_good_state.copy()
-                    x, y, w, h = map(
-                        int,
-                        cxy_wh_2_rect(
-                            self.state['target_pos'],
-                            self.state['target_sz']
-                        )
+        try:
+            while True:
+                # ---------------- RE-TARGET ----------------
+                pending = self._take_pending_target(wait=block_on_retarget and awaiting)
+                if pending:
+                    self._apply_target(pending, history, redetector)
+                    lost_count = 0
+                    if skipper is not None:
+                        skipper.reset()
+                    print("[INFO] New target")
+                if pending is not None:   # () → cancel_snapshot()
+                    history, awaiting = None, False
+                elif block_on_retarget and awaiting:
+                    continue
+
+                t = time.perf_counter()
+                ret, frame, t_capture = grabber.read()
+                if not ret:
+                    break
+                if self.state is not None and (frame.shape[0] != self.state.im_h or frame.shape[1] != self.state.im_w):
+                    raise RuntimeError(
+                        f"Frame is {frame.shape[1]}x{frame.shape[0]}, tracker was initialized on "
+                        f"{self.state.im_w}x{self.state.im_h} — init on a frame from the same source"
                     )
-            else:
-                lost_count = 0
-                self.last_good_state = self.state.copy()
+                self.metrics.mark('capture', t)
+
+                with self._target_lock:
+                    snapshot, self._snapshot_request = self._snapshot_request, None
+                if snapshot is not None:
+                    future, keep_history = snapshot
+                    future.set_result((frame.copy(), grabber.frame_time))
+                    history  = FrameHistory() if keep_history else None
+                    awaiting = True
+                elif history is not None:
+                    history.add(frame, grabber.frame_time)
+
+                # ---------------- IDLE (no target yet) ----------------
+                if self.state is None:
+                    if visualizer is not None:
+                        visualizer.submit(frame, None, (255, 255, 255), [
+                            f"{mode_label} | waiting for a target | Dropped:{grabber.dropped}",
+                        ])
+                        if visualizer.quit_requested:
+                            break
+                    yield None
+                    continue
+
+                # ✅ START TIMER (correct place)
+                t0 = time.perf_counter()
+
+                # ---------------- TRACKING ----------------
+                (x, y, w, h), score, weak, skipped = self.step(frame, grabber.frame_time, skipper)
+
+                if weak:
+                    lost_count += 1
+                    print(f"[WARN] Weak | score={score:.2f} | lost={lost_count}/{MAX_LOST}")
+                else:
+                    lost_count = 0
+                    reid_wait  = 0
+                    self.reid_cancel()
+                    if redetector is not None:
+                        redetector.cancel()   # recovered on its own
+
+                if lost_count >= MAX_LOST:
+                    # re-ID runs on its own thread: a search started on an
+                    # earlier lost frame is applied here, a new one started
+                    reid_hit = self.reid_poll(frame.shape[1], frame.shape[0], wait=block_on_retarget)
+                    if reid_hit is None:
+                        reid_wait -= 1
+                        if reid_wait <= 0 and self.reid_submit(frame):
+                            reid_wait = REID_EVERY
+                    if reid_hit is not None:
+                        (x, y, w, h), sim = reid_hit
+                        lost_count, reid_wait = 0, 0
+                        if skipper is not None:
+                            skipper.reset()
+                        if redetector is not None:
+                            redetector.cancel()
+                        print(f"[INFO] Target re-identified | similarity={sim:.2f}")
+                        yield (x, y, w, h)
+                        continue
+                    if redetector is not None:
+                        hit = redetector.poll()
+                        if hit is not None:
+                            hit_frame, mask, _ = hit
+                            x, y, w, h = self.init_from_mask(hit_frame, mask, new_target=False)
+                            lost_count = 0
+                            if skipper is not None:
+                                skipper.reset()
+                            print("[INFO] Target re-acquired")
+                            yield (x, y, w, h)
+                            continue
+                        redetector.submit(frame)
+                    print("[ERROR] Target LOST — holding last known bbox")
+                    lost_count = MAX_LOST
+                    yield (x, y, w, h)
+                    continue
+
+                # ✅ END TIMER (correct place)
+                dt = time.perf_counter() - t0
+
+                # --- Instant FPS ---
+                fps_inst = 1.0 / dt
+
+                # --- Smoothed FPS ---
+                if self.fps_ema is None:
+                    self.fps_ema = fps_inst
+                else:
+                    self.fps_ema = self.alpha_fps * self.fps_ema + (1 - self.alpha_fps) * fps_inst
+
+                # --- Model FPS ---
+                model_fps = getattr(self.state.net, "last_model_fps", 0.0)
+
+                # --- Capture → bbox latency ---
+                latency_ms = (time.perf_counter() - t_capture) * 1000
+
+                # ---------------- DISPLAY ----------------
+                # hand-off only — drawing / imshow run on the visualizer thread
+                if visualizer is not None:
+                    t = time.perf_counter()
+                    color = (0, 255, 0) if not weak else (0, 165, 255)
+                    if skipped:
+                        color = (255, 200, 0)
+                    vx, vy = self.velocity
+                    visualizer.submit(frame, (x, y, w, h), color, [
+                        f"{mode_label} | E2E:{int(self.fps_ema)} | Inst:{int(fps_inst)} | Model:{int(model_fps)} | S:{score:.2f}",
+                        f"Lat:{latency_ms:.0f}ms | Dropped:{grabber.dropped} | V:({vx:.0f},{vy:.0f})px/s"
+                        + (f" | Skipped:{skipper.total_skipped}" if skipper else ""),
+                    ])
+                    self.metrics.mark('display', t)
+                    if visualizer.quit_requested:
+                        break
 
-            if lost_count >= MAX_LOST:
-                print("[ERROR] Target LOST — holding last known bbox")
-                lost_count = MAX_LOST
                 yield (x, y, w, h)
-                continue
-
-            # ✅ END TIMER (correct place)
-            dt = time.perf_counter() - t0
-
-            # --- Instant FPS ---
-            fps_inst = 1.0 / dt
-
-            # --- Smoothed FPS ---
-            if self.fps_ema is None:
-                self.fps_ema = fps_inst
-            else:
-                self.fps_ema = self.alpha_fps * self.fps_ema + (1 - self.alpha_fps) * fps_inst
-
-            # --- Model FPS ---
-            model_fps = getattr(active_net, "last_model_fps", 0.0)
-
-            # ---------------- DISPLAY ----------------
-            if display:
-                color = (0, 255, 0) if not weak else (0, 165, 255)
-                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                cv2.putText(
-                    frame,
-                    f"{mode_label} | E2E:{int(self.fps_ema)} | Inst:{int(fps_inst)} | Model:{int(model_fps)} | S:{score:.2f}",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.65,
-                    color,
-                    2
-                )
-                cv2.imshow("DaSiamRPN", frame)
-
-            if cv2.waitKey(1) & 0xFF in [ord('q'), ord('Q')]:
-                break
-
-            yield (x, y, w, h)
\ No newline at end of file
+        finally:
+            if owns_source:
+                grabber.stop()
+            if visualizer is not None and owns_visualizer:
+                visualizer.stop()
+            if self.onnx_net is not None:
+                self.onnx_net.end_profiling()
+            print(f"[INFO] Tracking stopped | dropped frames: {grabber.dropped}")
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import socket
+import threading
+import numpy as np
+
+STAGES = ['capture', 'crop', 'inference', 'decode', 'post', 'reid', 'control', 'display']
+
+
+# ---------------------------------------------------------------
+# STAGE METRICS
+# ---------------------------------------------------------------
+class StageMetrics:
+    """
+    Per-stage timings in fixed-size ring buffers.
+    The hot path is mark(): one perf_counter() call and a list store
+    (well under a microsecond), so it can stay on in production.
+    Percentiles are computed only when asked for.
+    """
+    def __init__(self, stages=STAGES, capacity=1024):
+        self.capacity = capacity
+        self.buffers  = {}
+        self.counts   = {}
+        for stage in stages:
+            self._add_stage(stage)
+
+    def _add_stage(self, stage):
+        self.buffers[stage] = [0.0] * self.capacity
+        self.counts[stage]  = 0
+
+    def mark(self, stage, t0):
+        """
+        Records perf_counter() - t0 under stage.
+        Returns the new perf_counter() so stages can be chained:
+            t = metrics.mark('crop', t)
+        """
+        t = time.perf_counter()
+        n = self.counts.get(stage)
+        if n is None:
+            self._add_stage(stage)
+            n = 0
+        self.buffers[stage][n % self.capacity] = t - t0
+        self.counts[stage] = n + 1
+        return t
+
+    def record(self, stage, seconds):
+        """
+        Records a duration measured elsewhere — e.g. on a worker thread,
+        handed back with its result. Like mark(), not thread-safe: call it
+        from the thread that owns these metrics.
+        """
+        n = self.counts.get(stage)
+        if n is None:
+            self._add_stage(stage)
+            n = 0
+        self.buffers[stage][n % self.capacity] = seconds
+        self.counts[stage] = n + 1
+
+    def values(self, stage):
+        """Recorded durations in seconds, oldest first (empty for a stage never marked)."""
+        n = self.counts.get(stage, 0)
+        if n == 0:
+            return np.empty(0)
+        buf = self.buffers[stage]
+        if n <= self.capacity:
+            return np.array(buf[:n])
+        i = n % self.capacity
+        return np.array(buf[i:] + buf[:i])
+
+    def percentiles(self, stage, qs=(50, 95, 99)):
+        """Rolling percentiles in milliseconds (None if nothing recorded yet)."""
+        v = self.values(stage)
+        if v.size == 0:
+            return None
+        return dict(zip((f"p{q}" for q in qs), (np.percentile(v, qs) * 1e3).tolist()))
+
+    def summary(self):
+        return {stage: self.percentiles(stage) for stage in self.buffers if self.counts[stage]}
+
+    def reset(self):
+        for stage in self.buffers:
+            self.counts[stage] = 0
+
+    # -----------------------------------------------------------
+    # EXPORT FORMATS
+    # -----------------------------------------------------------
+    def to_json_line(self):
+        return json.dumps({
+            'ts'    : time.time(),
+            'counts': {s: n for s, n in self.counts.items() if n},
+            'ms'    : self.summary(),
+        })
+
+    def to_prometheus(self, prefix='falconeye'):
+        lines = [
+            f"# HELP {prefix}_stage_latency_ms Rolling stage latency percentiles",
+            f"# TYPE {prefix}_stage_latency_ms gauge",
+        ]
+        for stage, pct in self.summary().items():
+            for q, v in pct.items():
+                lines.append(f'{prefix}_stage_latency_ms{{stage="{stage}",quantile="0.{q[1:]}"}} {v:.4f}')
+        lines.append(f"# TYPE {prefix}_stage_samples_total counter")
+        for stage, n in self.counts.items():
+            if n:
+                lines.append(f'{prefix}_stage_samples_total{{stage="{stage}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------
+# PERIODIC EXPORTER
+# ---------------------------------------------------------------
+class MetricsExporter:
+    """
+    Dumps a StageMetrics snapshot every `interval` seconds on a daemon
+    thread, so formatting / I/O never runs inside the tracking loop.
+      fmt='jsonl'      : appends one JSON line per interval
+      fmt='prometheus' : atomically rewrites a text-exposition file
+                         (node_exporter textfile collector style)
+    socket_path sends the same payload as a Unix datagram instead
+    (dropped if nobody is listening).
+    """
+    def __init__(self, metrics, path=None, socket_path=None, fmt='jsonl', interval=1.0):
+        if path is None and socket_path is None:
+            raise ValueError("MetricsExporter needs a path or a socket_path")
+        if fmt not in ('jsonl', 'prometheus'):
+            raise ValueError(f"Unknown metrics format: {fmt}")
+        self.metrics     = metrics
+        self.path        = path
+        self.socket_path = socket_path
+        self.fmt         = fmt
+        self.interval    = interval
+        self.stop_event  = threading.Event()
+        self.thread      = None
+        self.sock        = None
+        if socket_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="MetricsExporter", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.export()
+
+    def export(self):
+        payload = self.metrics.to_json_line() + "\n" if self.fmt == 'jsonl' else self.metrics.to_prometheus()
+
+        if self.path:
+            if self.fmt == 'jsonl':
+                with open(self.path, 'a') as f:
+                    f.write(payload)
+            else:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(payload)
+                os.replace(tmp, self.path)
+
+        if self.sock is not None:
+            try:
+                self.sock.sendto(payload.encode(), self.socket_path)
+            except OSError:
+                pass   # no listener — metrics are best-effort
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval + 1)
+        self.export()   # final snapshot
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+# ---------------------------------------------------------------
+# CONSTANT-VELOCITY KALMAN FILTER
+# ---------------------------------------------------------------
+class ConstantVelocityKF:
+    """
+    Kalman filter on the target centre, state [cx, cy, vx, vy] in pixels
+    and pixels / second. Time steps come from frame timestamps, so late or
+    skipped frames are just a longer dt.
+    Used to
+      - centre the search crop where the target will be, not where it was
+        (fast lateral motion otherwise lands at the crop edge, where the
+        cosine window penalizes it)
+      - give a box on frames where the network is skipped or the track is weak
+      - hand the controller a smoothed velocity
+    """
+    def __init__(self, accel_std=300.0, meas_std=4.0, max_coast=0.5):
+        """
+        Args:
+            accel_std : white-noise acceleration, px/s² — how quickly the
+                        target may change velocity
+            meas_std  : tracker box-centre noise, px (at score 1)
+            max_coast : seconds without a measurement after which the
+                        prediction is no longer trusted
+        """
+        self.q         = accel_std ** 2
+        self.r         = meas_std ** 2
+        self.max_coast = max_coast
+
+        self.x = np.zeros(4)
+        self.P = np.eye(4)
+        self.F = np.eye(4)
+        self.Q = np.zeros((4, 4))
+        self.H = np.array([[1., 0., 0., 0.],
+                           [0., 1., 0., 0.]])
+        self.t          = None   # time the state refers to
+        self.t_measured = None   # time of the last update()
+
+    def reset(self, pos, t=None):
+        """Starts at pos with zero velocity (velocity uncertainty is large)."""
+        self.x[:2] = pos
+        self.x[2:] = 0.
+        self.P = np.diag([self.r, self.r, 500. ** 2, 500. ** 2])
+        self.t = self.t_measured = t
+
+    @property
+    def velocity(self):
+        return float(self.x[2]), float(self.x[3])
+
+    @property
+    def position(self):
+        return self.x[:2]
+
+    def coasting(self, t):
+        """True if the last measurement is older than max_coast."""
+        return self.t_measured is not None and t - self.t_measured > self.max_coast
+
+    def predict(self, t):
+        """Advances the state to time t. Returns the predicted centre (view, do not modify)."""
+        if self.t is None:
+            self.t = self.t_measured = t
+            return self.x[:2]
+        dt = t - self.t
+        if dt > 0:
+            self.F[0, 2] = self.F[1, 3] = dt
+            # continuous white-noise acceleration model
+            dt2, dt3 = dt * dt / 2, dt * dt * dt / 3
+            self.Q[0, 0] = self.Q[1, 1] = self.q * dt3
+            self.Q[0, 2] = self.Q[2, 0] = self.Q[1, 3] = self.Q[3, 1] = self.q * dt2
+            self.Q[2, 2] = self.Q[3, 3] = self.q * dt
+            self.x = self.F @ self.x
+            self.P = self.F @ self.P @ self.F.T + self.Q
+            self.t = t
+        return self.x[:2]
+
+    def update(self, pos, score=1.0):
+        """
+        Fuses a measured centre (call predict() for the same frame first).
+        Low-confidence boxes count as noisier measurements.
+        Returns:
+            normalized innovation squared (χ², 2 dof) — how surprising the
+            measurement was; ~2 on average for a well-tuned filter
+        """
+        y = np.asarray(pos, dtype=np.float64) - self.x[:2]
+        S = self.P[:2, :2] + np.eye(2) * (self.r / max(score, 0.05))
+        S_inv = np.linalg.inv(S)
+        K = self.P[:, :2] @ S_inv
+        self.x = self.x + K @ y
+        self.P = self.P - K @ self.H @ self.P
+        self.t_measured = self.t
+        return float(y @ S_inv @ y)
+
+
+# ---------------------------------------------------------------
+# ADAPTIVE FRAME SKIP
+# ---------------------------------------------------------------
+class AdaptiveSkip:
+    """
+    Runs the network only every (max_skip + 1)th frame once the track has
+    been stable for `stable_frames` network frames (confident score, motion
+    consistent with the filter); skipped frames use the Kalman prediction.
+    Any unstable frame drops back to running every frame.
+    """
+    def __init__(self, max_skip=2, stable_frames=10, min_score=0.8, max_nis=6.0):
+        self.max_skip      = max_skip
+        self.stable_frames = stable_frames
+        self.min_score     = min_score
+        self.max_nis       = max_nis
+        self.streak        = 0   # consecutive stable network frames
+        self.skipped       = 0   # frames skipped since the last network frame
+        self.total_skipped = 0
+
+    def should_skip(self):
+        if self.streak < self.stable_frames or self.skipped >= self.max_skip:
+            return False
+        self.skipped += 1
+        self.total_skipped += 1
+        return True
+
+    def observe(self, score, nis, weak):
+        """Call after every network frame."""
+        self.skipped = 0
+        if weak or score < self.min_score or nis > self.max_nis:
+            self.streak = 0
+        else:
+            self.streak += 1
+
+    def reset(self):
+        self.streak = self.skipped = 0
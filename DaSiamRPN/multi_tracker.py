@@ -0,0 +1,126 @@
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from run_SiamRPN import SiamRPN_init, search_region, update_state
+from utilities import cxy_wh_2_rect
+
+
+# ---------------------------------------------------------------
+# MULTI-TARGET TRACKER
+# ---------------------------------------------------------------
+class MultiTargetTracker:
+    """
+    Tracks N targets with one shared SiamRPN (PyTorch path).
+    Every frame the N search crops are stacked into one batch, run through
+    featureExtract once and correlated per target with a grouped conv
+    (SiamRPN.forward_multi). Targets whose instance_size differs
+    (adaptive configs) are batched separately.
+    """
+    def __init__(self, net):
+        """
+        Args:
+            net : loaded SiamRPN (e.g. DaSiamRPNTracker.pt_net) — its own
+                  r1_kernel / cls1_kernel are never modified
+        """
+        self.net     = net
+        self.device  = next(net.parameters()).device
+        self.states  = OrderedDict()   # target id → run_SiamRPN.TrackerState
+        self.next_id = 0
+        self.groups  = {}              # instance_size → batch tensors, rebuilt on add/remove
+
+    def __len__(self):
+        return len(self.states)
+
+    # -----------------------------------------------------------
+    # TARGET MANAGEMENT
+    # -----------------------------------------------------------
+    def add_target(self, frame, box):
+        """
+        Args:
+            frame : HxWxC numpy BGR
+            box   : (x_min, y_min, w, h)
+        Returns:
+            target id
+        """
+        x, y, w, h = box
+        target_pos = np.array([x + w / 2, y + h / 2])
+        target_sz  = np.array([w, h], dtype=np.float64)
+
+        state = SiamRPN_init(frame, target_pos, target_sz, self.net, temple=False)
+        with torch.no_grad():
+            state.r1_kernel, state.cls1_kernel = self.net.template_kernels(state.z)
+        state.z = None
+
+        target_id = self.next_id
+        self.next_id += 1
+        self.states[target_id] = state
+        self._rebuild_groups()
+        return target_id
+
+    def remove_target(self, target_id):
+        del self.states[target_id]
+        self._rebuild_groups()
+
+    def _rebuild_groups(self):
+        """Stack per-target kernels once per add/remove, not per frame."""
+        by_size = OrderedDict()
+        for target_id, state in self.states.items():
+            by_size.setdefault(state.p.instance_size, []).append(target_id)
+
+        self.groups = {}
+        for size, ids in by_size.items():
+            self.groups[size] = {
+                'ids'         : ids,
+                'r1_kernels'  : torch.cat([self.states[i].r1_kernel for i in ids]),
+                'cls1_kernels': torch.cat([self.states[i].cls1_kernel for i in ids]),
+                'crops'       : np.empty((len(ids), 3, size, size), np.float32),
+            }
+
+    # -----------------------------------------------------------
+    # TRACK ONE FRAME
+    # -----------------------------------------------------------
+    def track(self, frame):
+        """
+        Returns:
+            {target id: (x, y, w, h, score)}
+        """
+        results = {}
+
+        for group in self.groups.values():
+            ids   = group['ids']
+            crops = group['crops']
+            scales = []
+
+            for k, target_id in enumerate(ids):
+                state = self.states[target_id]
+                scale_z, s_x = search_region(state.p, state.target_sz)
+                state.cropper.crop(frame, state.target_pos, round(s_x), state.avg_chans, out=crops[k])
+                scales.append(scale_z)
+
+            with torch.no_grad():
+                x = torch.from_numpy(crops).to(self.device)
+                delta, score = self.net.forward_multi(x, group['r1_kernels'], group['cls1_kernels'])
+            delta = delta.cpu().numpy()
+            score = score.cpu().numpy()
+
+            for k, target_id in enumerate(ids):
+                state   = self.states[target_id]
+                scale_z = scales[k]
+                np.multiply(state.target_sz, scale_z, out=state.scaled_sz)
+                target_pos, target_sz, s = state.decoder.decode(
+                    delta[k:k + 1], score[k:k + 1],
+                    state.target_pos, state.scaled_sz, scale_z,
+                    out=(state.target_pos, state.target_sz)
+                )
+                update_state(state, target_pos, target_sz, s)
+
+                x, y, w, h = map(int, cxy_wh_2_rect(state.target_pos, state.target_sz))
+                results[target_id] = (x, y, w, h, float(s))
+
+        return results
@@ -46,13 +46,37 @@ class SiamRPN(nn.Module):
         return self.regress_adjust(F.conv2d(self.conv_r2(x_f), self.r1_kernel)), \
                F.conv2d(self.conv_cls2(x_f), self.cls1_kernel)
 
-    def temple(self, z):
+    def forward_multi(self, x, r1_kernels, cls1_kernels):
+        """
+        Batched search for N targets: crop i is correlated only with
+        target i's kernels (grouped conv).
+            x            : (N, 3, S, S)
+            r1_kernels   : (N*4*anchor, feature_out, k, k)
+            cls1_kernels : (N*2*anchor, feature_out, k, k)
+        """
+        n = x.size(0)
+        x_f = self.featureExtract(x)
+        r_f = self.conv_r2(x_f)
+        c_f = self.conv_cls2(x_f)
+        r_f = r_f.reshape(1, n * self.feature_out, r_f.size(2), r_f.size(3))
+        c_f = c_f.reshape(1, n * self.feature_out, c_f.size(2), c_f.size(3))
+
+        r = F.conv2d(r_f, r1_kernels, groups=n)
+        c = F.conv2d(c_f, cls1_kernels, groups=n)
+        return self.regress_adjust(r.view(n, self.anchor*4, r.size(2), r.size(3))), \
+               c.view(n, self.anchor*2, c.size(2), c.size(3))
+
+    def template_kernels(self, z):
+        """Same as temple() but returns (r1_kernel, cls1_kernel) instead of storing them."""
         z_f = self.featureExtract(z)
         r1_kernel_raw = self.conv_r1(z_f)
         cls1_kernel_raw = self.conv_cls1(z_f)
         kernel_size = r1_kernel_raw.data.size()[-1]
-        self.r1_kernel = r1_kernel_raw.view(self.anchor*4, self.feature_out, kernel_size, kernel_size)
-        self.cls1_kernel = cls1_kernel_raw.view(self.anchor*2, self.feature_out, kernel_size, kernel_size)
+        return r1_kernel_raw.view(self.anchor*4, self.feature_out, kernel_size, kernel_size), \
+               cls1_kernel_raw.view(self.anchor*2, self.feature_out, kernel_size, kernel_size)
+
+    def temple(self, z):
+        self.r1_kernel, self.cls1_kernel = self.template_kernels(z)
 
 
 class SiamRPNBIG(SiamRPN):
@@ -65,3 +89,19 @@ class SiamRPNvot(SiamRPN):
     def __init__(self):
         super(SiamRPNvot, self).__init__(size=1, feature_out=256)
         self.cfg = {'lr':0.45, 'window_influence': 0.44, 'penalty_k': 0.04, 'instance_size': 271, 'adaptive': False} # 0.355
+
+
+class SiamRPNSearch(nn.Module):
+    """
+    Search branch of a SiamRPN with the template kernels passed in as
+    inputs instead of read from module state. Used for ONNX export so one
+    graph serves every target.
+    """
+    def __init__(self, net):
+        super(SiamRPNSearch, self).__init__()
+        self.net = net
+
+    def forward(self, x, r1_kernel, cls1_kernel):
+        x_f = self.net.featureExtract(x)
+        return self.net.regress_adjust(F.conv2d(self.net.conv_r2(x_f), r1_kernel)), \
+               F.conv2d(self.net.conv_cls2(x_f), cls1_kernel)
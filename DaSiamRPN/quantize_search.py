@@ -0,0 +1,117 @@
+"""
+Builds optimized variants of the kernel-input search graph next to the
+cached FP32 one (see DaSiamRPNTracker.search_graph_path):
+
+  int8_dynamic : weights INT8, activations quantized at run time
+  int8_static  : weights + activations INT8 (QDQ), calibrated on
+                 recorded search crops (benchmark.py --record-crops)
+  fp16         : FP16 weights / compute, FP32 inputs and outputs
+                 (needs onnxconverter-common; best on GPU providers)
+
+Select a variant with DaSiamRPNTracker(onnx_variant=...) and check the
+accuracy drift with benchmark.py --variants fp32 int8_dynamic ...
+
+    python DaSiamRPN/benchmark.py seqs/person1 --backends onnx --record-crops calib.npz
+    python DaSiamRPN/quantize_search.py --calib calib.npz
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dasiam_tracker import DaSiamRPNTracker
+
+
+class _CropCalibrationReader:
+    """Feeds recorded (crop, kernels) pairs to quantize_static()."""
+    def __init__(self, calib_path, max_samples):
+        data = np.load(calib_path)
+        self.crops       = data['crops']
+        self.kernel_idx  = data['kernel_idx']
+        self.r1_kernel   = data['r1_kernel']
+        self.cls1_kernel = data['cls1_kernel']
+
+        # spread the samples over all recorded sequences
+        n = len(self.crops)
+        self.order = np.linspace(0, n - 1, min(n, max_samples)).astype(int)
+        self.pos   = 0
+
+    def get_next(self):
+        if self.pos >= len(self.order):
+            return None
+        i = self.order[self.pos]
+        self.pos += 1
+        k = self.kernel_idx[i]
+        return {
+            'search_crop': self.crops[i].astype(np.float32),
+            'r1_kernel'  : self.r1_kernel[k].astype(np.float32),
+            'cls1_kernel': self.cls1_kernel[k].astype(np.float32),
+        }
+
+    def rewind(self):
+        self.pos = 0
+
+
+def build_int8_dynamic(fp32_path, out_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+
+
+def build_int8_static(fp32_path, out_path, calib_path, max_samples):
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    quantize_static(
+        fp32_path,
+        out_path,
+        _CropCalibrationReader(calib_path, max_samples),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+def build_fp16(fp32_path, out_path):
+    import onnx
+    from onnxconverter_common import float16
+    model = onnx.load(fp32_path)
+    model = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model, out_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='models/SiamRPNVOT.model')
+    parser.add_argument('--cache-dir', help='ONNX search-graph cache (default: onnx_cache/ beside --model)')
+    parser.add_argument('--variants', nargs='+', default=['int8_dynamic', 'int8_static', 'fp16'],
+                        choices=['int8_dynamic', 'int8_static', 'fp16'])
+    parser.add_argument('--calib', help='calibration crops from benchmark.py --record-crops (int8_static)')
+    parser.add_argument('--calib-samples', type=int, default=200)
+    args = parser.parse_args()
+
+    tracker   = DaSiamRPNTracker(model_path=args.model, onnx_cache_dir=args.cache_dir)
+    fp32_path = tracker.export_search_graph()
+
+    for variant in args.variants:
+        out_path = tracker.search_graph_path(variant)
+        print(f"[INFO] Building {variant} → '{out_path}' ...")
+        try:
+            if variant == 'int8_dynamic':
+                build_int8_dynamic(fp32_path, out_path)
+            elif variant == 'int8_static':
+                if not args.calib:
+                    print("[WARN] int8_static needs --calib (benchmark.py --record-crops) — skipped")
+                    continue
+                build_int8_static(fp32_path, out_path, args.calib, args.calib_samples)
+            elif variant == 'fp16':
+                build_fp16(fp32_path, out_path)
+        except ImportError as e:
+            print(f"[WARN] {variant} skipped — missing dependency '{e.name}' "
+                  f"(pip install -r requirements.txt)")
+            continue
+        print(f"[INFO] {variant} ready ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
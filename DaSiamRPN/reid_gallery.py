@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utilities import get_subwindow_tracking
+
+TEMPLATE_FEAT = 6   # featureExtract maps the 127 px exemplar crop to 6x6
+
+
+# ---------------------------------------------------------------
+# APPEARANCE GALLERY
+# ---------------------------------------------------------------
+class ReIDGallery:
+    """
+    Fixed-capacity store of L2-normalized appearance embeddings of one
+    target, in a preallocated (capacity, dim) float32 array.
+    Eviction keeps the gallery diverse and fresh:
+      - a new embedding within `diversity` cosine of an existing one
+        replaces it (same view, newer look) instead of taking a slot
+      - when full, the oldest entry goes
+      - entry 0 (the prompt's view) is pinned and never evicted
+    match() scores any number of candidates against every entry with one
+    matrix product.
+    """
+    def __init__(self, capacity=32, diversity=0.95):
+        """
+        Args:
+            capacity  : embeddings kept at most
+            diversity : cosine similarity above which a new embedding
+                        counts as a duplicate of an existing one
+        """
+        self.capacity  = capacity
+        self.diversity = diversity
+        self.store     = None                     # (capacity, dim), allocated on first add
+        self.ages      = np.zeros(capacity, np.int64)   # insertion sequence number per entry
+        self.count     = 0
+        self.seq       = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+        self.seq   = 0
+
+    def copy(self):
+        """Independent copy — to match against on another thread while this one keeps growing."""
+        other = ReIDGallery(self.capacity, self.diversity)
+        other.store = None if self.store is None else self.store.copy()
+        other.ages  = self.ages.copy()
+        other.count = self.count
+        other.seq   = self.seq
+        return other
+
+    def add(self, embedding):
+        """
+        Args:
+            embedding : (dim,) L2-normalized
+        Returns:
+            index of the slot written
+        """
+        if self.store is None or self.store.shape[1] != embedding.shape[0]:
+            self.store = np.empty((self.capacity, embedding.shape[0]), np.float32)
+            self.count = 0
+
+        self.seq += 1
+        if self.count > 1:
+            sims = self.store[1:self.count] @ embedding
+            nearest = int(np.argmax(sims)) + 1
+            if sims[nearest - 1] >= self.diversity:
+                slot = nearest
+            elif self.count < self.capacity:
+                slot = self.count
+                self.count += 1
+            else:
+                slot = int(np.argmin(self.ages[1:self.count])) + 1
+        else:
+            slot = self.count
+            self.count += 1
+
+        self.store[slot] = embedding
+        self.ages[slot]  = self.seq
+        return slot
+
+    def match(self, embeddings):
+        """
+        Args:
+            embeddings : (N, dim) L2-normalized candidates
+        Returns:
+            (N,) best cosine similarity of each candidate to the gallery
+        """
+        if self.count == 0:
+            return np.full(len(embeddings), -1.0, np.float32)
+        return (embeddings @ self.store[:self.count].T).max(axis=1)
+
+
+# ---------------------------------------------------------------
+# SIAMRPN FEATURE EMBEDDINGS
+# ---------------------------------------------------------------
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-6)
+
+
+def exemplar_crop(frame, state):
+    """
+    The target's exemplar crop (same context as the template), a fresh
+    (3, exemplar_size, exemplar_size) float32 array — safe to hand to
+    another thread.
+    """
+    p = state.p
+    wc_z = state.target_sz[0] + p.context_amount * sum(state.target_sz)
+    hc_z = state.target_sz[1] + p.context_amount * sum(state.target_sz)
+    s_z  = round(np.sqrt(wc_z * hc_z))
+    return get_subwindow_tracking(frame, state.target_pos, p.exemplar_size, s_z, state.avg_chans)
+
+
+@torch.no_grad()   # grad mode is per thread — gallery updates run on a worker thread
+def embed_crop(net, z):
+    """exemplar_crop() through featureExtract, average-pooled over its 6x6 map → (C,) L2-normalized."""
+    z = torch.from_numpy(z).unsqueeze(0).to(next(net.parameters()).device)
+    z_f = net.featureExtract(z)
+    return _normalize(z_f.mean(dim=(2, 3))[0].cpu().numpy())
+
+
+def embed_target(net, frame, state):
+    """Appearance embedding of the current target → (C,) L2-normalized."""
+    return embed_crop(net, exemplar_crop(frame, state))
+
+
+@torch.no_grad()   # grad mode is per thread — searches run on a worker thread
+def search_frame(net, frame, p, target_sz, max_side=1024):
+    """
+    Dense candidates over the whole frame: the frame is scaled so the
+    target is at template scale and run through featureExtract once; every
+    6x6 window of the feature map (stride 8 px at template scale) is one
+    candidate, embedded like embed_target().
+    Args:
+        p         : the target's TrackerConfig
+        target_sz : (w, h) of the target in frame px
+        max_side  : longest side of the scaled frame (bounds the cost when
+                    the target is small in a large frame)
+    Returns:
+        ((N, C) L2-normalized embeddings, (N, 2) candidate centres in frame px)
+    """
+    wc_z = target_sz[0] + p.context_amount * sum(target_sz)
+    hc_z = target_sz[1] + p.context_amount * sum(target_sz)
+    scale = p.exemplar_size / np.sqrt(wc_z * hc_z)
+    frame_h, frame_w = frame.shape[:2]
+    scale = min(scale, max_side / max(frame_h, frame_w))
+
+    w, h = max(p.exemplar_size, round(frame_w * scale)), max(p.exemplar_size, round(frame_h * scale))
+    scaled = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    x = torch.from_numpy(scaled.transpose(2, 0, 1).astype(np.float32)).unsqueeze(0)
+    x_f = net.featureExtract(x.to(next(net.parameters()).device))
+
+    # one 6x6 window = one exemplar-sized candidate
+    pooled = F.avg_pool2d(x_f, TEMPLATE_FEAT, stride=1)[0]   # (C, Hc, Wc)
+    c, hc, wc = pooled.shape
+    emb = _normalize(pooled.reshape(c, -1).T.cpu().numpy())
+
+    # window (i, j) is centred at total_stride * (i, j) + exemplar centre
+    jj, ii = np.meshgrid(np.arange(wc), np.arange(hc))
+    centres = np.stack([jj.ravel(), ii.ravel()], axis=1) * p.total_stride + (p.exemplar_size - 1) / 2
+    centres[:, 0] *= frame_w / w
+    centres[:, 1] *= frame_h / h
+    return emb, centres
@@ -1,7 +1,8 @@
+import time
 import numpy as np
 import torch
 import torch.nn.functional as F
-from utilities import get_subwindow_tracking
+from utilities import get_subwindow_tracking, SubwindowCropper
 
 def generate_anchor(total_stride, scales, ratios, score_size):
     anchor_num = len(ratios) * len(scales)
@@ -56,7 +57,7 @@ class TrackerConfig(object):
         self.score_size = (self.instance_size - self.exemplar_size) / self.total_stride + 1
 
 
-def tracker_eval(net, x_crop, target_pos, target_sz, window, scale_z, p):
+def run_net(net, x_crop):
     if isinstance(net, torch.nn.Module):
         x_crop = torch.from_numpy(x_crop).float()
 
@@ -73,6 +74,11 @@ def tracker_eval(net, x_crop, target_pos, target_sz, window, scale_z, p):
         # ONNX path
         delta, score = net(x_crop)
 
+    return delta, score
+
+
+def tracker_decode(delta, score, target_pos, target_sz, window, scale_z, p):
+    """Reference decode over every anchor (see AnchorDecoder for the fast path)."""
     # reshape (match original torch logic)
     delta = delta.transpose(1, 2, 3, 0).reshape(4, -1)
     score = score.transpose(1, 2, 3, 0).reshape(2, -1)
@@ -129,15 +135,211 @@ def tracker_eval(net, x_crop, target_pos, target_sz, window, scale_z, p):
     return target_pos, target_sz, score[best_id]
 
 
-def SiamRPN_init(im, target_pos, target_sz, net):
-    state = dict()
+def tracker_eval(net, x_crop, target_pos, target_sz, window, scale_z, p):
+    delta, score = run_net(net, x_crop)
+    return tracker_decode(delta, score, target_pos, target_sz, window, scale_z, p)
+
+
+class AnchorDecoder(object):
+    """
+    Per-target precomputed replacement for tracker_decode().
+    Anchor columns and window terms are cached at SiamRPN_init time and the
+    full decode writes into reused buffers. Each frame a cheap pre-pass
+    bounds every anchor's penalized score (penalty <= 1), only the top_k
+    candidates are decoded, and the full decode runs only if the winner
+    could be beaten by an anchor outside the candidates — so the result
+    is always the same anchor tracker_decode() would pick.
+    """
+    def __init__(self, p, window, top_k=16):
+        n = p.anchor.shape[0]
+        self.n          = n
+        self.top_k      = min(top_k, n)
+        self.penalty_k  = p.penalty_k
+        self.lr         = p.lr
+        self.score_w    = 1 - p.window_influence
+
+        self.anchor_x   = np.ascontiguousarray(p.anchor[:, 0])
+        self.anchor_y   = np.ascontiguousarray(p.anchor[:, 1])
+        self.anchor_w   = np.ascontiguousarray(p.anchor[:, 2])
+        self.anchor_h   = np.ascontiguousarray(p.anchor[:, 3])
+        self.window_term = (window * p.window_influence).astype(np.float32)
+
+        # reused per-frame buffers
+        self.fg      = np.empty(n, np.float32)   # foreground probability
+        self.bound   = np.empty(n, np.float32)   # upper bound of pscore
+        self.w       = np.empty(n, np.float32)
+        self.h       = np.empty(n, np.float32)
+        self.tmp     = np.empty(n, np.float32)
+        self.tmp2    = np.empty(n, np.float32)
+        self.penalty = np.empty(n, np.float32)
+        self.pscore  = np.empty(n, np.float32)
+
+        # reused top-k candidate buffers
+        k = self.top_k
+        self.cand_w       = np.empty(k, np.float32)
+        self.cand_h       = np.empty(k, np.float32)
+        self.cand_tmp     = np.empty(k, np.float32)
+        self.cand_tmp2    = np.empty(k, np.float32)
+        self.cand_penalty = np.empty(k, np.float32)
+        self.cand_pscore  = np.empty(k, np.float32)
+
+    def _penalty(self, w, h, target_sz, out, tmp, tmp2):
+        """penalty = exp(-(r_c * s_c - 1) * k), written into out."""
+        pad = (target_sz[0] + target_sz[1]) * 0.5
+        target_s = np.sqrt((target_sz[0] + pad) * (target_sz[1] + pad))
+        target_r = target_sz[0] / target_sz[1]
+
+        # s_c = change(sz(w, h) / sz_wh(target_sz))
+        np.add(w, h, out=tmp)
+        tmp *= 0.5
+        np.add(w, tmp, out=out)
+        tmp += h
+        out *= tmp
+        np.sqrt(out, out=out)
+        out /= target_s
+        np.reciprocal(out, out=tmp)
+        np.maximum(out, tmp, out=out)
+
+        # r_c = change(target_ratio / (w / h))
+        np.divide(h, w, out=tmp)
+        tmp *= target_r
+        np.reciprocal(tmp, out=tmp2)
+        np.maximum(tmp, tmp2, out=tmp)
+
+        out *= tmp
+        out -= 1.
+        out *= -self.penalty_k
+        np.exp(out, out=out)
+        return out
+
+    def _decode_all(self, d, target_sz):
+        np.exp(d[2], out=self.w)
+        self.w *= self.anchor_w
+        np.exp(d[3], out=self.h)
+        self.h *= self.anchor_h
+
+        penalty = self._penalty(self.w, self.h, target_sz, self.penalty, self.tmp, self.tmp2)
+        np.multiply(penalty, self.fg, out=self.pscore)
+        self.pscore *= self.score_w
+        self.pscore += self.window_term
+
+        best = int(np.argmax(self.pscore))
+        return best, self.w[best], self.h[best], penalty[best]
+
+    def _decode_candidates(self, d, target_sz):
+        # argpartition has no out= — its k indices are the only per-frame allocation
+        cand = np.argpartition(self.bound, self.n - self.top_k)[self.n - self.top_k:]
+        w, h, tmp = self.cand_w, self.cand_h, self.cand_tmp
+
+        np.take(d[2], cand, out=w)
+        np.exp(w, out=w)
+        w *= np.take(self.anchor_w, cand, out=tmp)
+        np.take(d[3], cand, out=h)
+        np.exp(h, out=h)
+        h *= np.take(self.anchor_h, cand, out=tmp)
+
+        penalty = self._penalty(w, h, target_sz, self.cand_penalty, tmp, self.cand_tmp2)
+        pscore  = np.take(self.fg, cand, out=self.cand_pscore)
+        pscore *= penalty
+        pscore *= self.score_w
+        pscore += np.take(self.window_term, cand, out=tmp)
+
+        j = int(np.argmax(pscore))
+        # every anchor outside cand has bound <= min(bound[cand])
+        if pscore[j] < np.take(self.bound, cand, out=tmp).min():
+            return None
+        return int(cand[j]), w[j], h[j], penalty[j]
+
+    def decode(self, delta, score, target_pos, target_sz, scale_z, out=None):
+        """
+        Args:
+            delta, score : raw network outputs, (1, 4A, S, S) / (1, 2A, S, S)
+            target_sz    : previous size already multiplied by scale_z
+            out          : optional (pos, sz) arrays to write the result into
+                           (may be target_pos itself)
+        Returns:
+            (target_pos, target_sz, score) — same as tracker_decode()
+        """
+        d = delta.reshape(4, -1)
+        s = score.reshape(2, -1)
+
+        # 2-way softmax foreground prob == sigmoid(s1 - s0)
+        np.subtract(s[0], s[1], out=self.fg)
+        np.exp(self.fg, out=self.fg)
+        self.fg += 1.
+        np.reciprocal(self.fg, out=self.fg)
+
+        np.multiply(self.fg, self.score_w, out=self.bound)
+        self.bound += self.window_term
+
+        best = None
+        if self.top_k < self.n:
+            best = self._decode_candidates(d, target_sz)
+        if best is None:
+            best = self._decode_all(d, target_sz)
+        best_id, best_w, best_h, best_penalty = best
+
+        lr = best_penalty * self.fg[best_id] * self.lr
+        res_x = (d[0, best_id] * self.anchor_w[best_id] + self.anchor_x[best_id]) / scale_z + target_pos[0]
+        res_y = (d[1, best_id] * self.anchor_h[best_id] + self.anchor_y[best_id]) / scale_z + target_pos[1]
+        res_w = (target_sz[0] * (1 - lr) + best_w * lr) / scale_z
+        res_h = (target_sz[1] * (1 - lr) + best_h * lr) / scale_z
+
+        if out is None:
+            return np.array([res_x, res_y]), np.array([res_w, res_h]), float(self.fg[best_id])
+        pos, sz = out
+        pos[0], pos[1] = res_x, res_y
+        sz[0], sz[1] = res_w, res_h
+        return pos, sz, float(self.fg[best_id])
+
+
+class TrackerState(object):
+    """
+    Per-target tracking state (was a dict). target_pos / target_sz are
+    fixed float64 arrays updated in place every frame; snapshot() and
+    restore() copy them to / from preallocated slots, so keeping a
+    "last good" state costs no allocation.
+    The remaining fields are set once by SiamRPN_init.
+    """
+    __slots__ = (
+        'p', 'net', 'avg_chans', 'window', 'cropper', 'decoder', 'im_h', 'im_w',
+        'target_pos', 'target_sz', 'score', 'scaled_sz',
+        'z', 'r1_kernel', 'cls1_kernel',              # multi-target tracking only
+        'good_pos', 'good_sz', 'good_score',
+    )
+
+    def __init__(self, target_pos, target_sz, im_h, im_w):
+        self.im_h       = im_h
+        self.im_w       = im_w
+        self.target_pos = np.array(target_pos, dtype=np.float64)
+        self.target_sz  = np.array(target_sz, dtype=np.float64)
+        self.score      = 1.0
+        self.scaled_sz  = np.empty(2)   # target_sz * scale_z scratch
+        self.good_pos   = self.target_pos.copy()
+        self.good_sz    = self.target_sz.copy()
+        self.good_score = 1.0
+        self.z = self.r1_kernel = self.cls1_kernel = None
+
+    def snapshot(self):
+        np.copyto(self.good_pos, self.target_pos)
+        np.copyto(self.good_sz, self.target_sz)
+        self.good_score = self.score
+
+    def restore(self):
+        np.copyto(self.target_pos, self.good_pos)
+        np.copyto(self.target_sz, self.good_sz)
+        self.score = self.good_score
+
+
+def SiamRPN_init(im, target_pos, target_sz, net, temple=True):
+    # temple=False leaves net untouched and keeps the exemplar in state.z
+    # (multi-target tracking computes per-target kernels itself)
+    state = TrackerState(target_pos, target_sz, im.shape[0], im.shape[1])
     p = TrackerConfig()
     p.update(net.cfg)
-    state['im_h'] = im.shape[0]
-    state['im_w'] = im.shape[1]
 
     if p.adaptive:
-        if ((target_sz[0] * target_sz[1]) / float(state['im_h'] * state['im_w'])) < 0.004:
+        if ((target_sz[0] * target_sz[1]) / float(state.im_h * state.im_w)) < 0.004:
             p.instance_size = 287  # small object big search region
         else:
             p.instance_size = 271
@@ -156,7 +358,10 @@ def SiamRPN_init(im, target_pos, target_sz, net):
 
     z = torch.from_numpy(z_crop).float().unsqueeze(0)
     z = z.to(next(net.parameters()).device)
-    net.temple(z)
+    if temple:
+        net.temple(z)
+    else:
+        state.z = z
 
     if p.windowing == 'cosine':
         window = np.outer(np.hanning(p.score_size), np.hanning(p.score_size))
@@ -164,42 +369,63 @@ def SiamRPN_init(im, target_pos, target_sz, net):
         window = np.ones((p.score_size, p.score_size))
     window = np.tile(window.flatten(), p.anchor_num)
 
-    state['p'] = p
-    state['net'] = net
-    state['avg_chans'] = avg_chans
-    state['window'] = window
-    state['target_pos'] = target_pos
-    state['target_sz'] = target_sz
+    state.p = p
+    state.net = net
+    state.avg_chans = avg_chans
+    state.window = window
+    state.cropper = SubwindowCropper(p.instance_size)
+    state.decoder = AnchorDecoder(p, window)
     return state
 
 
-def SiamRPN_track(state, im):
-    p = state['p']
-    net = state['net']
-    avg_chans = state['avg_chans']
-    window = state['window']
-    target_pos = state['target_pos']
-    target_sz = state['target_sz']
-
-    wc_z = target_sz[1] + p.context_amount * sum(target_sz)
-    hc_z = target_sz[0] + p.context_amount * sum(target_sz)
+def search_region(p, target_sz):
+    """Returns (scale_z, s_x) for the search crop around the previous target."""
+    context = p.context_amount * (target_sz[0] + target_sz[1])
+    wc_z = target_sz[1] + context
+    hc_z = target_sz[0] + context
     s_z = np.sqrt(wc_z * hc_z)
     scale_z = p.exemplar_size / s_z
     d_search = (p.instance_size - p.exemplar_size) / 2
     pad = d_search / scale_z
     s_x = s_z + 2 * pad
+    return scale_z, s_x
+
+
+def update_state(state, target_pos, target_sz, score):
+    """Clamps to the image and stores into state (in place)."""
+    pos, sz = state.target_pos, state.target_sz
+    pos[0] = max(0, min(state.im_w, target_pos[0]))
+    pos[1] = max(0, min(state.im_h, target_pos[1]))
+    sz[0] = max(10, min(state.im_w, target_sz[0]))
+    sz[1] = max(10, min(state.im_h, target_sz[1]))
+    state.score = score
+    return state
+
+
+def SiamRPN_track(state, im, metrics=None):
+    # metrics: optional StageMetrics — records crop / inference / decode
+    # state is updated in place (and returned for convenience)
+    if metrics is not None:
+        t = time.perf_counter()
+
+    scale_z, s_x = search_region(state.p, state.target_sz)
 
     # extract scaled crops for search region x at previous target position
-    x_crop = np.expand_dims(
-        get_subwindow_tracking(im, target_pos, p.instance_size, round(s_x), avg_chans),axis=0
+    # (written into the cropper's reused (1,3,S,S) buffer)
+    x_crop = state.cropper.crop(im, state.target_pos, round(s_x), state.avg_chans)
+    if metrics is not None:
+        t = metrics.mark('crop', t)
+
+    delta, score = run_net(state.net, x_crop)
+    if metrics is not None:
+        t = metrics.mark('inference', t)
+
+    np.multiply(state.target_sz, scale_z, out=state.scaled_sz)
+    target_pos, target_sz, score = state.decoder.decode(
+        delta, score, state.target_pos, state.scaled_sz, scale_z,
+        out=(state.target_pos, state.target_sz)
     )
-
-    target_pos, target_sz, score = tracker_eval(net, x_crop, target_pos, target_sz * scale_z, window, scale_z, p)
-    target_pos[0] = max(0, min(state['im_w'], target_pos[0]))
-    target_pos[1] = max(0, min(state['im_h'], target_pos[1]))
-    target_sz[0] = max(10, min(state['im_w'], target_sz[0]))
-    target_sz[1] = max(10, min(state['im_h'], target_sz[1]))
-    state['target_pos'] = target_pos
-    state['target_sz'] = target_sz
-    state['score'] = score
+    update_state(state, target_pos, target_sz, score)
+    if metrics is not None:
+        metrics.mark('decode', t)
     return state
@@ -68,6 +68,49 @@ def get_subwindow_tracking(im, pos, model_sz, original_sz, avg_chans, out_mode='
     return im_patch
 
 
+class SubwindowCropper:
+    """
+    Zero-allocation version of get_subwindow_tracking() for the per-frame
+    search crop. Crop, avg_chans border fill and scaling are one
+    cv2.warpAffine into a reused HWC patch, which is then cast straight
+    into a reused (1, 3, model_sz, model_sz) float32 buffer.
+    The returned buffer is overwritten on the next crop() call; pass
+    out=(3, model_sz, model_sz) float32 view to write into e.g. a batch slot.
+    """
+    def __init__(self, model_sz):
+        self.model_sz = model_sz
+        self.patch    = np.empty((model_sz, model_sz, 3), np.uint8)
+        self.buffer   = np.empty((1, 3, model_sz, model_sz), np.float32)
+        self.M        = np.zeros((2, 3), np.float64)
+        self.chw_view = self.patch.transpose(2, 0, 1)   # HWC → CHW view, no copy
+
+    def crop(self, im, pos, original_sz, avg_chans, out=None):
+        c = (original_sz + 1) / 2
+        context_xmin = round(pos[0] - c)
+        context_ymin = round(pos[1] - c)
+
+        # dst → src mapping with the same pixel-centre convention as cv2.resize;
+        # pixels outside the image take avg_chans (BORDER_CONSTANT)
+        scale = original_sz / self.model_sz
+        self.M[0, 0] = scale
+        self.M[1, 1] = scale
+        self.M[0, 2] = context_xmin + 0.5 * scale - 0.5
+        self.M[1, 2] = context_ymin + 0.5 * scale - 0.5
+
+        cv2.warpAffine(
+            im, self.M, (self.model_sz, self.model_sz),
+            dst=self.patch,
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(float(avg_chans[0]), float(avg_chans[1]), float(avg_chans[2])),
+        )
+        if out is not None:
+            np.copyto(out, self.chw_view)
+            return out
+        np.copyto(self.buffer[0], self.chw_view)   # uint8 → float32 + CHW in one pass
+        return self.buffer
+
+
 def cxy_wh_2_rect(pos, sz):
     return np.array([pos[0]-sz[0]/2, pos[1]-sz[1]/2, sz[0], sz[1]])  # 0-index
 
@@ -0,0 +1,134 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import cv2
+
+
+# ---------------------------------------------------------------
+# RATE-LIMITED VISUALIZER
+# ---------------------------------------------------------------
+class Visualizer:
+    """
+    Draws and shows the latest tracked frame on its own thread, at most
+    max_fps times per second. submit() only swaps a reference, so
+    rendering never delays the bbox sent to the controller; frames
+    submitted faster than the display rate are simply skipped.
+    All HighGUI calls happen on this thread (fine on Linux / Jetson,
+    macOS only allows HighGUI on the main thread) — other threads that
+    need a window (e.g. the prompt UI) run their GUI code here with call().
+    """
+    def __init__(self, window="DaSiamRPN", max_fps=15, max_width=960):
+        """
+        Args:
+            max_width : wider (native-resolution) frames are downscaled for
+                        display here, on the visualizer thread
+        """
+        self.window         = window
+        self.period         = 1.0 / max_fps
+        self.max_width      = max_width
+        self.latest         = None
+        self.cond           = threading.Condition()
+        self.running        = False
+        self.quit_requested = False   # set when 'q' is pressed in the window
+        self.calls          = deque()   # (Future, fn, args) to run on this thread
+        self.thread         = None
+
+    def start(self):
+        self.running = True
+        self.thread  = threading.Thread(target=self._run, name="Visualizer", daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, frame, box, color, lines):
+        """
+        Args:
+            frame : BGR frame — must not be modified by the caller afterwards
+            box   : (x, y, w, h) or None
+            color : BGR tuple for box and text
+            lines : overlay text lines
+        """
+        with self.cond:
+            self.latest = (frame, box, color, lines)
+            self.cond.notify()
+
+    def call(self, fn, *args):
+        """
+        Runs fn(*args) on the visualizer thread, between two frames.
+        HighGUI is not thread-safe: windows, mouse callbacks and dialogs of
+        other threads go through here. Windows opened this way have their
+        events pumped by the visualizer's own waitKey.
+        Returns:
+            Future → fn's return value (or exception)
+        """
+        future = Future()
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("Visualizer is not running")
+            self.calls.append((future, fn, args))
+            self.cond.notify()
+        return future
+
+    def _run_calls(self):
+        while True:
+            with self.cond:
+                if not self.calls:
+                    return
+                future, fn, args = self.calls.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _run(self):
+        next_draw = time.perf_counter()
+        while self.running:
+            with self.cond:
+                self.cond.wait_for(lambda: self.latest is not None or self.calls or not self.running, timeout=0.1)
+                item, self.latest = self.latest, None
+            self._run_calls()
+            if item is None:
+                if self.running:
+                    cv2.waitKey(1)   # keep the window responsive while idle
+                continue
+
+            frame, box, color, lines = item
+            if frame.shape[1] > self.max_width:
+                s = self.max_width / frame.shape[1]
+                frame = cv2.resize(frame, (self.max_width, round(frame.shape[0] * s)), interpolation=cv2.INTER_AREA)
+                if box is not None:
+                    box = tuple(int(v * s) for v in box)
+            if box is not None:
+                x, y, w, h = box
+                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+            for i, line in enumerate(lines):
+                cv2.putText(frame, line, (10, 30 + 25 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2)
+            cv2.imshow(self.window, frame)
+
+            if cv2.waitKey(1) & 0xFF in [ord('q'), ord('Q')]:
+                self.quit_requested = True
+
+            next_draw += self.period
+            delay = next_draw - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_draw = time.perf_counter()
+
+        cv2.destroyWindow(self.window)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        # calls queued after the thread's last pass never run
+        with self.cond:
+            calls, self.calls = self.calls, deque()
+        for future, _, _ in calls:
+            future.cancel()
@@ -1,76 +1,210 @@
+import os
 import torch
 import numpy as np
+from collections import OrderedDict
 from PIL import Image
 import cv2
 import torch.nn.functional as F
-from transformers import CLIPSegProcessor, CLIPSegForImageSegmentation
-from sam_model import call_sam
+from sam_model import call_sam_batch, frame_digest
+from utils.model_registry import registry
+from utils.mask_analysis import box_xyxy, mask_box, mask_stats
 
 device = torch.device("cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu")
 
-# --- Load CLIPSeg ---
+# --- Lazy CLIPSeg loading (first use or registry.prefetch) ---
 MODEL_ID = "CIDAS/clipseg-rd64-refined"
-processor = CLIPSegProcessor.from_pretrained(
-    MODEL_ID,
-    backend="torchvision"
-)
-model = CLIPSegForImageSegmentation.from_pretrained(
-    MODEL_ID,
-    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-).to(device)
 
-model.eval()
+def _load_clipseg():
+    from transformers import CLIPSegProcessor, CLIPSegForImageSegmentation
+    processor = CLIPSegProcessor.from_pretrained(
+        MODEL_ID,
+        backend="torchvision"
+    )
+    model = CLIPSegForImageSegmentation.from_pretrained(
+        MODEL_ID,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+    ).to(device)
 
-# --- Main segmentation function ---
-def clipping(frame: np.ndarray, ref_image: np.ndarray = None, text: str = None) -> np.ndarray:
-    if (ref_image is None) and (text is None):
-        raise ValueError("Provide either a reference image or a text prompt.")
+    model.eval()
+    return processor, model
+
+registry.register("clipseg", _load_clipseg)
+
+# --- Prompt embedding cache ---
+# The CLIP text / visual encoder only depends on the prompt, which rarely
+# changes between calls (re-detection, checks on new frames) — keep its
+# conditional embedding and only run the image side per call.
+PROMPT_CACHE_MAX = 256                     # entries, one (1, 512) vector each
+_prompt_cache = OrderedDict()              # "text:..." / "image:<digest>" → embedding
+
+def _prompt_key(ref_image=None, text=None):
+    if ref_image is not None:
+        return "image:" + frame_digest(ref_image.astype(np.uint8))
+    return "text:" + text
+
+def prompt_embeddings(texts=(), ref_images=()) -> torch.Tensor:
+    """
+    (K, projection_dim) conditional embeddings, texts first then reference
+    images, LRU-cached per prompt. Cache misses of each kind are encoded
+    in one batched call.
+    """
+    texts, ref_images = list(texts), list(ref_images)
+    keys = [_prompt_key(text=t) for t in texts] + [_prompt_key(ref_image=r) for r in ref_images]
+    found = {k: _prompt_cache[k] for k in keys if k in _prompt_cache}
+    for k in found:
+        _prompt_cache.move_to_end(k)
+
+    miss_texts  = [i for i, t in enumerate(texts) if keys[i] not in found]
+    miss_images = [i for i, r in enumerate(ref_images) if keys[len(texts) + i] not in found]
+    if miss_texts or miss_images:
+        processor, model = registry.get("clipseg")
+        with torch.no_grad():
+            # duplicates within one call are encoded once
+            miss_texts = list({keys[i]: i for i in miss_texts}.values())
+            if miss_texts:
+                cond = processor(text=[texts[i] for i in miss_texts], padding=True, return_tensors="pt")
+                emb = model.get_conditional_embeddings(
+                    batch_size=len(miss_texts),
+                    input_ids=cond["input_ids"].to(device),
+                    attention_mask=cond["attention_mask"].to(device),
+                )
+                for i, e in zip(miss_texts, emb):
+                    found[keys[i]] = e[None]
+            miss_images = list({keys[len(texts) + i]: i for i in miss_images}.values())
+            if miss_images:
+                ref_pils = [Image.fromarray(ref_images[i].astype(np.uint8)) for i in miss_images]
+                cond = processor(images=ref_pils, return_tensors="pt")["pixel_values"].to(device, model.dtype)
+                emb = model.get_conditional_embeddings(batch_size=len(miss_images), conditional_pixel_values=cond)
+                for i, e in zip(miss_images, emb):
+                    found[keys[len(texts) + i]] = e[None]
+        for k in keys:
+            if k not in _prompt_cache:
+                _prompt_cache[k] = found[k]
+        while len(_prompt_cache) > PROMPT_CACHE_MAX:
+            _prompt_cache.popitem(last=False)
 
-    frame = frame.astype(np.uint8)
-    image_pil = Image.fromarray(frame)
-    original_h, original_w = frame.shape[:2]
+    return torch.cat([found[k] for k in keys])
 
-    # --- Reference image mode ---
+def prompt_embedding(ref_image: np.ndarray = None, text: str = None) -> torch.Tensor:
+    """(1, projection_dim) conditional embedding for a text or reference image, LRU-cached."""
     if ref_image is not None:
-        ref_pil = Image.fromarray(ref_image.astype(np.uint8))
-        cond = processor(images=ref_pil, return_tensors="pt")["pixel_values"].to(device)
+        return prompt_embeddings(ref_images=[ref_image])
+    return prompt_embeddings(texts=[text])
+
+def save_prompt_cache(path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    torch.save({
+        "model": MODEL_ID,
+        "embeddings": {k: v.float().cpu() for k, v in _prompt_cache.items()},
+    }, tmp)
+    os.replace(tmp, path)
+    print(f"[INFO] CLIPSeg prompt cache saved → '{path}' ({len(_prompt_cache)} prompts)")
+
+def load_prompt_cache(path: str):
+    """Merges a saved cache (ignored if missing or built with another model)."""
+    if not os.path.exists(path):
+        return
+    data = torch.load(path, map_location="cpu")
+    if data.get("model") != MODEL_ID:
+        print(f"[WARN] Prompt cache '{path}' was built for {data.get('model')} — ignored")
+        return
+    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    for k, v in data["embeddings"].items():
+        _prompt_cache[k] = v.to(device, dtype)
+    while len(_prompt_cache) > PROMPT_CACHE_MAX:
+        _prompt_cache.popitem(last=False)
+    print(f"[INFO] CLIPSeg prompt cache loaded ← '{path}' ({len(data['embeddings'])} prompts)")
+
+def clear_prompt_cache():
+    _prompt_cache.clear()
 
-        inputs = processor(images=image_pil, return_tensors="pt")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+# --- Batched segmentation ---
+def clipping_batch(frames, texts=(), ref_images=(), refine=True, threshold=0.5):
+    """
+    Segments K prompts in F frames with one CLIPSeg forward pass over the
+    F x K pairs (and one batched SAM decode per frame with refine).
+    Args:
+        frames     : list of HxWx3 RGB frames (sizes may differ)
+        texts      : text prompts
+        ref_images : reference-image prompts (prompt order: texts, then images)
+        refine     : False → skip SAM, return CLIPSeg's thresholded mask
+                     (coarse, but enough for a box)
+        threshold  : CLIPSeg foreground probability threshold
+    Returns:
+        results[f][k] = (mask HxW uint8, box (x, y, w, h) of the largest
+        component or None, score)
+        box follows cv2.boundingRect (w / h in px, x + w one past the last
+        column); SAM is still prompted with the tight box over every
+        CLIPSeg pixel, as inclusive corners
+        score is CLIPSeg's peak foreground probability
+    """
+    texts, ref_images = list(texts), list(ref_images)
+    n_prompts = len(texts) + len(ref_images)
+    if not frames or n_prompts == 0:
+        raise ValueError("Provide at least one frame and one text or reference image prompt.")
 
-        inputs["conditional_pixel_values"] = cond
+    processor, model = registry.get("clipseg")
+    frames = [f.astype(np.uint8) for f in frames]
 
-    else:  # text is not None
-        inputs = processor(images=image_pil, text=[text], return_tensors="pt")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+    # --- Prompt side: cached embeddings, tiled over frames ---
+    conditional = prompt_embeddings(texts, ref_images)                       # (K, D)
+    conditional = conditional.repeat(len(frames), 1)                         # (F*K, D), frame-major
+
+    # --- Image side: processor once, each frame repeated per prompt ---
+    pixel_values = processor(images=[Image.fromarray(f) for f in frames], return_tensors="pt")["pixel_values"]
+    pixel_values = pixel_values.to(device, model.dtype).repeat_interleave(n_prompts, dim=0)
 
     # --- Model inference ---
     with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        if logits.ndim == 3:
-            logits = logits.unsqueeze(1)
-
-        resized_logits = F.interpolate(
-            logits,
-            size=(original_h, original_w),
-            mode='bilinear',
-            align_corners=False
-        )
-
-    # --- Binary mask ---
-    mask = torch.sigmoid(resized_logits).squeeze().cpu().numpy()
-    binary_mask = (mask > 0.5).astype(np.uint8)
-
-    # --- Check if anything was detected ---
-    ys, xs = np.where(binary_mask > 0)
-    if ys.size == 0 or xs.size == 0:
-        print("⚠️ CLIPSeg found no matching region.")
-        return np.zeros((original_h, original_w), dtype=np.uint8)
+        logits = model(pixel_values=pixel_values, conditional_embeddings=conditional).logits
+        logits = logits.reshape(-1, 1, *logits.shape[-2:]).float()
+
+    results = []
+    for f, frame in enumerate(frames):
+        h, w = frame.shape[:2]
+        with torch.no_grad():
+            probs = torch.sigmoid(F.interpolate(
+                logits[f * n_prompts:(f + 1) * n_prompts],
+                size=(h, w),
+                mode='bilinear',
+                align_corners=False
+            ))[:, 0].cpu().numpy()
+
+        masks  = (probs > threshold).astype(np.uint8)
+        scores = probs.reshape(n_prompts, -1).max(axis=1)
+        stats  = [mask_stats(m) for m in masks]
+        boxes  = [st.box if st is not None else None for st in stats]
+
+        # --- SAM refinement: all detected prompts of this frame in one decode ---
+        # prompt = tight box over all CLIPSeg pixels (a fragmented object keeps
+        # every part), first / last pixel inclusive
+        hits = [k for k, st in enumerate(stats) if st is not None]
+        if refine and hits:
+            xyxy = np.array([box_xyxy(stats[k].tight_box) for k in hits])
+            for k, sam_mask in zip(hits, call_sam_batch(frame, xyxy)):
+                masks[k] = sam_mask
+                boxes[k] = mask_box(sam_mask)
+
+        results.append([(masks[k], boxes[k], float(scores[k])) for k in range(n_prompts)])
+    return results
 
-    # --- SAM refinement ---
-    x0, y0, x1, y1 = xs.min(), ys.min(), xs.max(), ys.max()
-    box = np.array([x0, y0, x1, y1])
-    sam_mask = call_sam(frame, box)
+# --- Main segmentation function ---
+def clipping(frame: np.ndarray, ref_image: np.ndarray = None, text: str = None, return_score: bool = False):
+    """
+    Segments the prompted object (CLIPSeg, refined by SAM).
+    Returns:
+        mask, or (mask, score) with return_score — score is CLIPSeg's
+        peak foreground probability
+    """
+    if (ref_image is None) and (text is None):
+        raise ValueError("Provide either a reference image or a text prompt.")
 
-    return sam_mask
\ No newline at end of file
+    if ref_image is not None:
+        (mask, box, score), = clipping_batch([frame], ref_images=[ref_image])[0]
+    else:
+        (mask, box, score), = clipping_batch([frame], texts=[text])[0]
+
+    if box is None:
+        print("⚠️ CLIPSeg found no matching region.")
+    return (mask, score) if return_score else mask
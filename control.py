@@ -1,41 +1,158 @@
 # rover_control.py
+import os
+import time
+import select
+import socket
+import struct
+import threading
 import subprocess
+from collections import namedtuple
+
+# --- Binary protocol (must match rover_controller.cpp) ---
+BBOX_MAGIC = 0x31424546   # "FEB1"  Python → controller
+CMD_MAGIC  = 0x31434546   # "FEC1"  controller → Python
+FLAG_STOP  = 1
+
+# magic, seq, t_sent, x, y, w, h, vx, vy, frame_w, frame_h, flags
+# (vx, vy: target velocity, px/s; box and velocity are in the declared
+#  frame_w x frame_h geometry)
+BBOX_MSG = struct.Struct('<IIdffffffHHI')
+# magic, seq, t_echo, left, right, loop_us, dropped
+CMD_MSG  = struct.Struct('<IIdfffI')
+
+ControlReply = namedtuple(
+    'ControlReply',
+    ['seq', 'left', 'right', 'rtt_ms', 'loop_us', 'dropped']
+)
+
 
 class RoverController:
-    def __init__(self, exe_path="./rover_controller"):
+    def __init__(self, exe_path="./rover_controller", socket_path=None, metrics=None, frame_size=(640, 480)):
+        """
+        Args:
+            exe_path    : compiled rover_controller binary
+            frame_size  : (width, height) of the frames the boxes refer to —
+                          the native camera resolution the tracker runs at
+            socket_path : None → binary messages over stdin/stdout pipes,
+                          else over a Unix socket the controller listens on
+            metrics     : optional StageMetrics — send_bbox() time is
+                          recorded as the 'control' stage
+        """
+        args = [exe_path] + (["--socket", socket_path] if socket_path else [])
         self.proc = subprocess.Popen(
-            [exe_path],
+            args,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
+            bufsize=0
         )
+
+        if socket_path:
+            self.sock = self._connect(socket_path)
+            self.out_fd = self.sock.fileno()
+            self.in_fd  = self.sock.fileno()
+        else:
+            self.sock = None
+            self.out_fd = self.proc.stdin.fileno()
+            self.in_fd  = self.proc.stdout.fileno()
+
+        # sends never block the tracking loop — a full pipe drops the box
+        os.set_blocking(self.out_fd, False)
+
+        self.metrics       = metrics
+        self.frame_w, self.frame_h = (int(v) for v in frame_size)
+        self.seq           = 0
+        self.send_dropped  = 0
+        self.latest_reply  = None
+        self.lock          = threading.Lock()
+        self.reader        = threading.Thread(target=self._read_replies, name="RoverReplies", daemon=True)
+        self.reader.start()
         print("✅ Rover controller started")
 
-    def send_bbox(self, bbox):
+    def _connect(self, socket_path, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(socket_path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() > deadline or self.proc.poll() is not None:
+                    raise RuntimeError(f"Cannot connect to rover controller on {socket_path}")
+                time.sleep(0.05)
+
+    def _read_replies(self):
+        buf = bytearray()
+        while True:
+            try:
+                # in socket mode in_fd == out_fd, which is non-blocking
+                select.select([self.in_fd], [], [])
+                chunk = os.read(self.in_fd, 4096)
+            except BlockingIOError:
+                continue
+            except (OSError, ValueError):
+                break
+            if not chunk:
+                break
+            buf += chunk
+
+            while len(buf) >= CMD_MSG.size:
+                magic, seq, t_echo, left, right, loop_us, dropped = CMD_MSG.unpack_from(buf)
+                if magic != CMD_MAGIC:
+                    del buf[0]   # resync
+                    continue
+                del buf[:CMD_MSG.size]
+
+                reply = ControlReply(seq, left, right, (time.monotonic() - t_echo) * 1000, loop_us, dropped)
+                with self.lock:
+                    if self.latest_reply is None or seq > self.latest_reply.seq:
+                        self.latest_reply = reply
+
+    def _send(self, x, y, w, h, vx=0.0, vy=0.0, flags=0):
+        self.seq += 1
+        msg = BBOX_MSG.pack(BBOX_MAGIC, self.seq, time.monotonic(), x, y, w, h, vx, vy,
+                            self.frame_w, self.frame_h, flags)
+        try:
+            sent = os.write(self.out_fd, msg)
+        except BlockingIOError:
+            self.send_dropped += 1   # controller is behind — a newer box follows next frame
+            return
+        if sent < len(msg):
+            # rare partial write on a stream socket: finish it to keep framing
+            os.set_blocking(self.out_fd, True)
+            os.write(self.out_fd, msg[sent:])
+            os.set_blocking(self.out_fd, False)
+
+    def send_bbox(self, bbox, velocity=None):
         """
-        bbox: (x, y, w, h) or None
-        returns controller response string
+        bbox     : (x, y, w, h) or None
+        velocity : (vx, vy) target velocity in px/s (DaSiamRPNTracker.velocity),
+                   used by the controller to lead the target; None → (0, 0)
+        Non-blocking. Returns the latest ControlReply received so far
+        (usually for an earlier bbox), or None before the first reply.
         """
+        t0 = time.perf_counter()
         if bbox is None:
-            self.proc.stdin.write("0 0 0 0\n")
-            self.proc.stdin.flush()
-            return "STOP"
-
-        x, y, w, h = bbox
-        self.proc.stdin.write(f"{x} {y} {w} {h}\n")
-        self.proc.stdin.flush()
+            self._send(0, 0, 0, 0, flags=FLAG_STOP)
+        else:
+            x, y, w, h = bbox
+            vx, vy = velocity if velocity is not None else (0.0, 0.0)
+            self._send(x, y, w, h, vx, vy)
 
-        return self.proc.stdout.readline().strip()
+        with self.lock:
+            reply = self.latest_reply
+        if self.metrics is not None:
+            self.metrics.mark('control', t0)
+        return reply
 
     def stop(self):
         if self.proc:
-            self.proc.stdin.write("0 0 0 0\n")
-            self.proc.stdin.flush()
+            self._send(0, 0, 0, 0, flags=FLAG_STOP)
 
     def close(self):
         if self.proc:
+            if self.sock is not None:
+                self.sock.close()
             self.proc.terminate()
             self.proc.wait()
             print("🛑 Rover stopped")
@@ -1,4 +1,7 @@
+import os
 import time
+import argparse
+import threading
 from tkinter import Tk
 from tkinter.filedialog import askopenfilename
 from PIL import Image
@@ -6,84 +9,263 @@ import torch
 import cv2
 import numpy as np
 
-from sam_model import segment_on_click
-from clipseg import clipping
+from sam_model import collect_clicks, SAM_BACKENDS
 from utils.image_preprocessing import preprocess_frame
 # from control import RoverController
-from utils.boundingbox import get_boundary
+from utils.model_registry import registry
+from utils.prompt_sidecar import sidecar_path, load_prompt_sidecar, save_prompt_sidecar
 from DaSiamRPN.dasiam_tracker import DaSiamRPNTracker
+from DaSiamRPN.capture import open_source, ReplaySource
+from DaSiamRPN.metrics import MetricsExporter
+from DaSiamRPN.visualizer import Visualizer
+from redetect import Prompt, Redetector
+from segmentation_service import SegmentationService
 
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Cannot open camera")
-print("Capturing frame...")
-time.sleep(2)
-
-ret, frame = cap.read()
-if not ret:
-    print("Cannot capture frame")
-    exit()
-
-rgb_frame, frame_resized = preprocess_frame(frame)
-
-cv2.imshow("Captured Frame", frame)
-
-# Show for 2 seconds
-cv2.waitKey(2000)
-
-cv2.destroyWindow("Captured Frame")
-
-cap.release()
-
-print("Choose an option:")
-print("1. Click")
-print("2. Reference image")
-print("3. Text")
-
-choice = input("Enter 1, 2, or 3: ").strip()
-if choice=='1':
-    clicks=int(input("Enter number of clicks: "))
-    mask = segment_on_click(rgb_frame,clicks)
-elif choice=='2':
-    Tk().withdraw()
-    image_path = askopenfilename(title="Select an image file", filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp")])
-    ref_image = Image.open(image_path).convert("RGB")
-    ref_image = np.array(ref_image)
-    ref_image = cv2.resize(ref_image, (512, 512))
-    mask=clipping(rgb_frame,ref_image=ref_image)
-elif choice=='3':
-    text_prompt = input("Enter text prompt: ")
-    mask=clipping(rgb_frame, text=text_prompt)
-else:
-    print("Invalid choice. Exiting.")
-    exit()
-
-bbox, frame_with_box = get_boundary(mask, frame_resized)
-if bbox:
-    print("Bounding box:", bbox)
-    cv2.imshow("Tracked Object", frame_with_box)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
-# rover = RoverController("./rover_controller")
-
-tracker = DaSiamRPNTracker()
-bbox = tracker.init_from_mask(rgb_frame, mask)
-print("[INFO] Initialized with bbox:", bbox)
-try:
-    for box in tracker.track_live(video_src=0, display=True):
-        print("BBox:", box)
-
-        if box is None:
-            bbox = None
+# per-stage p50/p95/p99 dump, e.g. "falconeye_metrics.jsonl" (None = off)
+METRICS_EXPORT = None
+
+# re-run the original prompt in a worker process when the target is lost
+REDETECT = True
+
+# CLIPSeg text / reference-image embeddings, kept between runs
+PROMPT_CACHE = "models/clipseg_prompt_cache.pt"
+
+# live cameras: let exposure / white balance settle before the prompt frame
+CAMERA_WARMUP_S = 2.0
+
+registry.register("dasiam", DaSiamRPNTracker)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="FalconEye: prompt → segment → track")
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file, image directory, .npy recording "
+                             "((N, H, W, 3) uint8 BGR) or stream URL")
+    parser.add_argument("--fast", action="store_true",
+                        help="recorded sources: replay every frame as fast as possible "
+                             "(deterministic) instead of in real time")
+    parser.add_argument("--fps", type=float,
+                        help="recorded sources: frame rate (image directories / .npy default 30)")
+    parser.add_argument("--prompt",
+                        help="prompt sidecar JSON (default: <source>.prompt.json if it exists)")
+    parser.add_argument("--save-prompt", metavar="PATH",
+                        help="write the interactive prompt as a sidecar for later replays")
+    parser.add_argument("--headless", action="store_true", help="no windows (needs a prompt sidecar)")
+    parser.add_argument("--metrics", default=METRICS_EXPORT, help="per-stage latency export (.jsonl)")
+    parser.add_argument("--sam-backend", default="torch", choices=SAM_BACKENDS,
+                        help="SAM mask decoder: PyTorch, or ONNX Runtime on CPU (exported on first use)")
+    return parser.parse_args()
+
+
+def ask_image_path():
+    root = Tk()
+    root.withdraw()
+    try:
+        return askopenfilename(parent=root, title="Select an image file",
+                               filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp")])
+    finally:
+        root.destroy()
+
+
+def choose_prompt(rgb_frame, frame, scale, ui):
+    """
+    Interactive prompt on the snapshot frame. Every GUI call runs on the
+    visualizer thread (ui.call), which owns HighGUI while tracking runs;
+    this thread only reads the console.
+    Returns:
+        (kind, value) as in a prompt sidecar — box / click coordinates in
+        the native frame, value is the file path for a reference image —
+        or (None, None) for an invalid choice
+    """
+    # the snapshot stays up while the prompt is chosen
+    ui.call(cv2.imshow, "Captured Frame", frame).result()
+    try:
+        print("Choose an option:")
+        print("1. Click")
+        print("2. Reference image")
+        print("3. Text")
+
+        choice = input("Enter 1, 2, or 3: ").strip()
+        if choice=='1':
+            clicks=int(input("Enter number of clicks: "))
+            coords = collect_clicks(rgb_frame, clicks, ui)
+            return "clicks", [(x / scale[0], y / scale[1]) for x, y in coords]
+        elif choice=='2':
+            image_path = ui.call(ask_image_path).result()
+            return ("image", image_path) if image_path else (None, None)
+        elif choice=='3':
+            text_prompt = input("Enter text prompt: ")
+            return "text", text_prompt
+        print("Invalid choice.")
+        return None, None
+    finally:
+        if ui.running:
+            ui.call(cv2.destroyWindow, "Captured Frame").result()
+
+
+def segment_target(service, frame, kind, value):
+    """
+    Resolves a prompt on a snapshot frame; segmentation runs on the
+    512x512 frame in the service process, the tracker maps it to the
+    native frame.
+    Returns:
+        (mask or None, native box or None, Prompt for re-detection)
+    """
+    rgb_frame, frame_resized = preprocess_frame(frame)
+    # native frame → the resized frame segmentation runs on
+    scale = (rgb_frame.shape[1] / frame.shape[1], rgb_frame.shape[0] / frame.shape[0])
+
+    if kind == "box":
+        x, y, w, h = (int(value[0] * scale[0]), int(value[1] * scale[1]), int(value[2] * scale[0]), int(value[3] * scale[1]))
+        mask = np.zeros(rgb_frame.shape[:2], np.uint8)
+        mask[y:y + h, x:x + w] = 1
+        return None, value, Prompt.from_mask(rgb_frame, mask)
+    if kind == "clicks":
+        points = [(x * scale[0], y * scale[1]) for x, y in value]
+        mask = service.segment(frame_resized, points=points).result().mask
+        return mask, None, Prompt.from_mask(rgb_frame, mask)
+
+    if kind == "image":
+        ref_image = value if isinstance(value, np.ndarray) else np.array(Image.open(value).convert("RGB"))
+        prompt = Prompt(ref_image=cv2.resize(ref_image, (512, 512)))
+    else:
+        prompt = Prompt(text=value)
+    mask = service.segment(frame_resized, prompt=prompt).result().mask
+    return mask, None, prompt
+
+
+def prompt_loop(tracker, service, source, spec=None, first_snapshot=None, ui=None, save_path=None):
+    """
+    Prompt stage, on its own thread: snapshot → prompt → segment →
+    tracker.retarget(), while the tracking loop keeps streaming and
+    tracking. Loops for mid-run re-targeting while interactive.
+    Args:
+        spec           : PromptSpec from a sidecar for the first target
+        first_snapshot : request_snapshot() future already placed before
+                         the tracking loop started (replays: the prompt
+                         frame is exact)
+        ui             : the tracking loop's running Visualizer, for the
+                         interactive prompt — None → sidecar prompt only
+    """
+    interactive = ui is not None
+    replay = isinstance(source, ReplaySource)
+    first  = True
+    while True:
+        if first_snapshot is None:
+            if spec is not None and first:
+                time.sleep(CAMERA_WARMUP_S)   # live camera, sidecar prompt
+            else:
+                input("[INFO] Press Enter to pick a target\n" if first else "[INFO] Press Enter to re-target\n")
+        future, first_snapshot = first_snapshot or tracker.request_snapshot(), None
+        frame, frame_time = future.result()
+
+        if spec is not None and first:
+            kind, value = spec.kind, spec.value
+            print(f"[INFO] Prompt from sidecar | {kind} on frame {spec.frame}")
         else:
-            bbox = tuple(box)
+            rgb_frame, _ = preprocess_frame(frame)
+            kind, value = choose_prompt(rgb_frame, frame, (rgb_frame.shape[1] / frame.shape[1], rgb_frame.shape[0] / frame.shape[0]), ui)
+            if kind is None:
+                tracker.cancel_snapshot()
+                continue
+            if save_path:
+                save_prompt_sidecar(save_path, kind, value, frame=round(frame_time * source.fps) if replay else 0)
+        first = False
+
+        try:
+            mask, box, prompt = segment_target(service, frame, kind, value)
+        except (RuntimeError, ValueError) as e:
+            print(f"[WARN] Prompt failed: {e}")
+            mask, box = None, None
+        if box is None and (mask is None or not mask.any()):
+            print("[WARN] Nothing found for this prompt — keeping the current target")
+            tracker.cancel_snapshot()
+        else:
+            tracker.retarget(frame, mask=mask, box=box, prompt=prompt)
+
+        if not interactive:
+            return
+
+
+def main():
+    args = parse_args()
+
+    # SAM + CLIPSeg load in the segmentation process, the tracker here —
+    # both warm up in the background while the camera starts
+    service = SegmentationService(prompt_cache=PROMPT_CACHE, sam_backend=args.sam_backend).start()
+    registry.prefetch(["dasiam"])
+
+    prompt_path = args.prompt or sidecar_path(args.source)
+    spec = None
+    if args.prompt or (prompt_path and os.path.exists(prompt_path)):
+        spec = load_prompt_sidecar(prompt_path)
+    if args.headless and spec is None:
+        print("--headless needs a prompt sidecar (--prompt or <source>.prompt.json)")
+        service.stop()
+        exit()
+
+    # the source stays open from here on — prompting and segmentation run
+    # on snapshots while it keeps streaming
+    source = open_source(args.source, realtime=not args.fast, fps=args.fps).start()
+
+    tracker = registry.get("dasiam")
+    registry.report()
+
+    # rover = RoverController("./rover_controller", metrics=tracker.metrics, frame_size=...)  # native frame size
+
+    first_snapshot = None
+    if isinstance(source, ReplaySource):
+        # replays prompt on an exact frame: the sidecar's, else the first
+        source.index = spec.frame if spec is not None else 0
+        first_snapshot = tracker.request_snapshot()
+
+    exporter = MetricsExporter(tracker.metrics, path=args.metrics).start() if args.metrics else None
+    redetector = Redetector(None, service).start() if REDETECT else None
+    # one HighGUI thread for the tracking view and the prompt UI
+    visualizer = None if args.headless else Visualizer().start()
+
+    prompt_errors = []
+    def run_prompts():
+        try:
+            prompt_loop(tracker, service, source, spec, first_snapshot, visualizer, args.save_prompt)
+        except Exception as e:
+            prompt_errors.append(e)
+            tracker.cancel_snapshot()   # never leave track_live waiting for this retarget
+
+    prompter = threading.Thread(target=run_prompts, name="Prompt", daemon=True)
+    prompter.start()
+    try:
+        # as-fast-as-possible replays wait for each prompt → deterministic runs
+        for box in tracker.track_live(video_src=source, display=visualizer or False,
+                                      redetector=redetector, block_on_retarget=args.fast):
+            if prompt_errors:
+                break
+            if box is None:
+                bbox = None
+            else:
+                bbox = tuple(box)
+                print("BBox:", bbox)
+
+            # ctrl_out = rover.send_bbox(bbox, tracker.velocity)
+            # print("[CTRL]", ctrl_out)
+
+    except KeyboardInterrupt:
+        print("🛑 Tracking stopped")
+
+    source.stop()
+    if visualizer:
+        visualizer.stop()
+    if exporter:
+        exporter.stop()
+    if redetector:
+        redetector.stop()
+    service.stop()
+    if prompt_errors:
+        raise RuntimeError("Prompt stage failed") from prompt_errors[0]
 
-        # ctrl_out = rover.send_bbox(bbox)
-        # print("[CTRL]", ctrl_out)
+    # finally:
+        # rover.close()
 
-except KeyboardInterrupt:
-    print("🛑 Tracking stopped")
 
-# finally:
-    # rover.close()
+if __name__ == "__main__":
+    main()
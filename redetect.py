@@ -0,0 +1,144 @@
+import time
+import numpy as np
+
+from segmentation_service import SegmentationService
+from utils.mask_analysis import mask_stats
+
+
+# ---------------------------------------------------------------
+# PROMPT — what the user originally asked to track
+# ---------------------------------------------------------------
+class Prompt:
+    """
+    The original target prompt, kept for re-acquisition.
+    A click prompt has no text / image to re-run, so the clicked object
+    itself becomes the reference image (see from_mask).
+    """
+    def __init__(self, text=None, ref_image=None):
+        if (text is None) == (ref_image is None):
+            raise ValueError("Prompt needs exactly one of text / ref_image")
+        self.text      = text
+        self.ref_image = ref_image
+
+    @classmethod
+    def from_mask(cls, rgb_frame, mask, background=0.3):
+        """
+        Reference image = the mask's bounding box crop with everything
+        outside the mask darkened, so CLIPSeg keys on the object rather
+        than on what happened to be behind it.
+        """
+        stats = mask_stats(mask)
+        if stats is None:
+            raise ValueError("Mask is empty — nothing to re-detect")
+        x0, y0, w, h = stats.box
+        x1, y1 = x0 + w, y0 + h
+        crop = rgb_frame[y0:y1, x0:x1].astype(np.float32)
+        inside = (mask[y0:y1, x0:x1] > 0)[..., None]
+        crop = np.where(inside, crop, crop * background)
+        return cls(ref_image=crop.astype(np.uint8))
+
+    def __repr__(self):
+        return f"Prompt(text={self.text!r})" if self.text is not None else f"Prompt(ref_image={self.ref_image.shape})"
+
+
+# ---------------------------------------------------------------
+# RE-DETECTOR
+# ---------------------------------------------------------------
+class Redetector:
+    """
+    Re-acquires a lost target by re-running the original prompt on the
+    segmentation service. Non-blocking on the tracking side:
+        redetector.submit(frame)  — queues a search if none is running
+        redetector.poll()         — (frame, mask, score) of a confident hit, else None
+    At most one search is in flight; results for frames submitted before
+    cancel() (e.g. the tracker recovered on its own) are dropped.
+    """
+    def __init__(self, prompt, service=None, min_score=0.6, min_area=100, interval=0.5):
+        """
+        Args:
+            prompt    : Prompt (text, reference image or Prompt.from_mask),
+                        or None until a target is set (tracker.retarget())
+            service   : running SegmentationService to share (e.g. with the
+                        initial prompt); None → start() launches a private one
+            min_score : CLIPSeg peak probability needed to accept a hit
+            min_area  : smallest accepted mask, in pixels
+            interval  : min seconds between two searches
+        """
+        self._prompt   = prompt
+        self.min_score = min_score
+        self.min_area  = min_area
+        self.interval  = interval
+        self.pending   = None   # (bgr frame, Future) of the search in flight
+        self.last_submit = 0.0
+
+        self.owns_service = service is None
+        self.service = SegmentationService() if self.owns_service else service
+
+    @property
+    def prompt(self):
+        return self._prompt
+
+    @prompt.setter
+    def prompt(self, prompt):
+        """New target: the old prompt is dropped from the service's worker."""
+        if self._prompt is not None and self._prompt is not prompt:
+            self.service.forget_prompt(self._prompt)
+        self._prompt = prompt
+
+    def start(self):
+        if self.owns_service:
+            self.service.start()
+        print(f"[INFO] Re-detector started | {self.prompt}")
+        return self
+
+    def submit(self, frame):
+        """
+        frame: BGR frame the tracker sees. Ignored while a search is in
+        flight, before the service has loaded its models, or within
+        `interval` of the previous search.
+        """
+        now = time.monotonic()
+        if self.prompt is None or not self.service.ready.is_set() or self.pending is not None \
+                or now - self.last_submit < self.interval:
+            return False
+        future = self.service.segment(frame, prompt=self.prompt, block=False)
+        if future is None:
+            return False   # service busy with other requests
+        self.pending = (frame.copy(), future)
+        self.last_submit = now
+        return True
+
+    def poll(self):
+        """
+        Returns:
+            (frame, mask, score) if the finished search found the target
+            confidently — frame is the one the search ran on, so the
+            tracker template comes from the same pixels as the mask —
+            else None
+        """
+        if self.pending is None or not self.pending[1].done():
+            return None
+        frame, future = self.pending
+        self.pending = None
+        try:
+            mask, box, area, score = future.result()
+        except Exception as e:   # the next lost frame retries
+            print(f"[WARN] Re-detection failed: {e}")
+            return None
+        if box is None or score < self.min_score or area < self.min_area:
+            print(f"[INFO] Re-detection miss | score={score:.2f}")
+            return None
+        print(f"[INFO] Re-detection hit | score={score:.2f}")
+        return frame, mask, score
+
+    def cancel(self):
+        """Forget the search in flight — its result will be ignored."""
+        if self.pending is not None:
+            self.pending[1].cancel()
+            self.pending = None
+
+    def stop(self):
+        self.cancel()
+        if self.owns_service:
+            self.service.stop()
+        print("[INFO] Re-detector stopped")
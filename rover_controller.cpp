@@ -2,11 +2,21 @@
 #include <cmath>
 #include <thread>
 #include <chrono>
+#include <mutex>
+#include <condition_variable>
+#include <cstdint>
+#include <cstring>
+#include <string>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <sys/un.h>
 
 
 // ---------------- CONFIG ----------------
-constexpr int FRAME_WIDTH  = 640;
-constexpr int FRAME_HEIGHT = 480;
+// geometry the reference box below is given in; boxes arrive in the
+// sender's declared frame geometry and the reference area is scaled to it
+constexpr int REF_FRAME_WIDTH  = 640;
+constexpr int REF_FRAME_HEIGHT = 480;
 
 constexpr float X_DEADZONE_RATIO = 0.08f;   // 8% frame width
 constexpr float AREA_TOLERANCE   = 0.15f;   // ±15%
@@ -14,15 +24,51 @@ constexpr float AREA_TOLERANCE   = 0.15f;   // ±15%
 constexpr float KP_X = 0.003f;   // yaw gain
 constexpr float KP_D = 0.8f;     // distance gain
 
+constexpr float LOOKAHEAD_S = 0.15f;   // yaw aims where the target will be (≈ pipeline + actuation lag)
+
 constexpr float MAX_LINEAR  = 1.0f;
 constexpr float MAX_ANGULAR = 0.8f;
 
 constexpr int CONTROL_HZ = 30;
 // ---------------------------------------
 
+// ---------------- PROTOCOL ----------------
+// Fixed-size little-endian messages, must match control.py
+constexpr uint32_t BBOX_MAGIC = 0x31424546;   // "FEB1"  Python → controller
+constexpr uint32_t CMD_MAGIC  = 0x31434546;   // "FEC1"  controller → Python
+constexpr uint32_t FLAG_STOP  = 1u;
+
+#pragma pack(push, 1)
+struct BBoxMsg {
+    uint32_t magic;
+    uint32_t seq;
+    double   t_sent;     // sender clock, echoed back untouched
+    float    x, y, w, h;
+    float    vx, vy;     // target velocity, px/s (0 if the tracker has no motion model)
+    uint16_t frame_w;    // geometry the box is given in (native camera resolution)
+    uint16_t frame_h;
+    uint32_t flags;
+};
+
+struct CmdMsg {
+    uint32_t magic;
+    uint32_t seq;        // seq of the bbox this command was computed from
+    double   t_echo;     // t_sent of that bbox
+    float    left;
+    float    right;
+    float    loop_us;    // bbox receipt → command written
+    uint32_t dropped;    // bboxes superseded before they were used (total)
+};
+#pragma pack(pop)
+
+static_assert(sizeof(BBoxMsg) == 48, "BBoxMsg layout must match control.py");
+static_assert(sizeof(CmdMsg)  == 32, "CmdMsg layout must match control.py");
+// ---------------------------------------
+
 // Bounding box
 struct BBox {
     float x, y, w, h;
+    float vx, vy;
 };
 
 // Motor command
@@ -49,18 +95,24 @@ float bbox_area(const BBox& b) {
 // ---------------- CONTROL CORE ----------------
 MotorCmd compute_control(
     const BBox& bbox,
-    float ref_area
+    float ref_area,
+    float frame_w,
+    float frame_h
 ) {
-    float frame_center_x = FRAME_WIDTH / 2.0f;
-    float obj_center_x   = bbox_center_x(bbox);
+    // reference area is defined at REF_FRAME_WIDTH x REF_FRAME_HEIGHT
+    ref_area *= (frame_w * frame_h) / float(REF_FRAME_WIDTH * REF_FRAME_HEIGHT);
+
+    float frame_center_x = frame_w / 2.0f;
+    // lead the target by its velocity so yaw does not lag a moving object
+    float obj_center_x   = bbox_center_x(bbox) + bbox.vx * LOOKAHEAD_S;
     float dx             = obj_center_x - frame_center_x;
 
-    float x_deadzone = FRAME_WIDTH * X_DEADZONE_RATIO;
+    float x_deadzone = frame_w * X_DEADZONE_RATIO;
 
     // -------- YAW CONTROL (CENTERING) --------
     float omega = 0.0f;
     if (std::fabs(dx) > x_deadzone) {
-        omega = KP_X * dx;
+        omega = KP_X * dx * (REF_FRAME_WIDTH / frame_w);   // gain is per reference-frame pixel
     }
 
     omega = clamp(omega, -MAX_ANGULAR, MAX_ANGULAR);
@@ -93,35 +145,172 @@ MotorCmd compute_control(
     return cmd;
 }
 
+// ---------------- I/O HELPERS ----------------
+bool read_exact(int fd, void* buf, size_t n) {
+    char* p = static_cast<char*>(buf);
+    while (n > 0) {
+        ssize_t r = ::read(fd, p, n);
+        if (r <= 0) return false;
+        p += r;
+        n -= static_cast<size_t>(r);
+    }
+    return true;
+}
+
+bool write_exact(int fd, const void* buf, size_t n) {
+    const char* p = static_cast<const char*>(buf);
+    while (n > 0) {
+        ssize_t w = ::write(fd, p, n);
+        if (w <= 0) return false;
+        p += w;
+        n -= static_cast<size_t>(w);
+    }
+    return true;
+}
+
+// Reads one BBoxMsg, sliding byte-by-byte until the magic lines up again
+bool read_bbox(int fd, BBoxMsg& msg) {
+    if (!read_exact(fd, &msg, sizeof(msg))) return false;
+    while (msg.magic != BBOX_MAGIC) {
+        std::cerr << "[WARN] Bad message magic — resyncing\n";
+        char* raw = reinterpret_cast<char*>(&msg);
+        std::memmove(raw, raw + 1, sizeof(msg) - 1);
+        if (!read_exact(fd, raw + sizeof(msg) - 1, 1)) return false;
+    }
+    return true;
+}
+
+int accept_unix_socket(const std::string& path) {
+    int server = ::socket(AF_UNIX, SOCK_STREAM, 0);
+    sockaddr_un addr{};
+    addr.sun_family = AF_UNIX;
+    std::strncpy(addr.sun_path, path.c_str(), sizeof(addr.sun_path) - 1);
+    ::unlink(path.c_str());
+
+    if (server < 0 ||
+        ::bind(server, reinterpret_cast<sockaddr*>(&addr), sizeof(addr)) < 0 ||
+        ::listen(server, 1) < 0) {
+        std::cerr << "[ERROR] Cannot listen on " << path << "\n";
+        return -1;
+    }
+    std::cerr << "[INIT] Waiting for tracker on " << path << "\n";
+    int conn = ::accept(server, nullptr, nullptr);
+    ::close(server);
+    return conn;
+}
+
+// ---------------- LATEST-COMMAND-WINS SLOT ----------------
+struct LatestBBox {
+    std::mutex              m;
+    std::condition_variable cv;
+    BBoxMsg                 msg{};
+    std::chrono::steady_clock::time_point received;
+    bool                    fresh   = false;
+    bool                    closed  = false;
+    uint32_t                dropped = 0;
+};
+
+// Drains the input as fast as it arrives so stale boxes never queue up
+void reader_loop(int fd, LatestBBox& latest) {
+    uint32_t last_seq = 0;
+    BBoxMsg msg;
+
+    while (read_bbox(fd, msg)) {
+        if (msg.seq <= last_seq) {
+            continue;   // outdated / duplicate
+        }
+        last_seq = msg.seq;
+
+        std::lock_guard<std::mutex> lock(latest.m);
+        if (latest.fresh) {
+            latest.dropped++;   // previous box never reached the control loop
+        }
+        latest.msg      = msg;
+        latest.received = std::chrono::steady_clock::now();
+        latest.fresh    = true;
+        latest.cv.notify_one();
+    }
+
+    std::lock_guard<std::mutex> lock(latest.m);
+    latest.closed = true;
+    latest.cv.notify_one();
+}
+
 // ---------------- MAIN LOOP ----------------
-int main() {
+int main(int argc, char** argv) {
     // Reference bounding box (measured at ~30 cm)
-    BBox reference_bbox = {200, 120, 120, 160};
+    BBox reference_bbox = {200, 120, 120, 160, 0.f, 0.f};
     float reference_area = bbox_area(reference_bbox);
 
-    std::cout << "[INIT] Reference area = " << reference_area << std::endl;
+    // stdout carries binary replies — all logging goes to stderr
+    std::cerr << "[INIT] Reference area = " << reference_area << std::endl;
 
-while (true) {
-    BBox bbox;
-
-    if (!(std::cin >> bbox.x >> bbox.y >> bbox.w >> bbox.h)) {
-        std::cerr << "[WARN] Input stream closed. Exiting.\n";
-        break;
+    int in_fd  = STDIN_FILENO;
+    int out_fd = STDOUT_FILENO;
+    for (int i = 1; i + 1 < argc; ++i) {
+        if (std::string(argv[i]) == "--socket") {
+            in_fd = out_fd = accept_unix_socket(argv[i + 1]);
+            if (in_fd < 0) return 1;
+        }
     }
 
-    if (bbox.w == 0 || bbox.h == 0) {
-        std::cout << "LEFT: 0 | RIGHT: 0\n";
-        continue;
-    }
+    LatestBBox latest;
+    std::thread reader(reader_loop, in_fd, std::ref(latest));
 
-    MotorCmd cmd = compute_control(bbox, reference_area);
+    const auto period = std::chrono::milliseconds(1000 / CONTROL_HZ);
+    auto next_tick = std::chrono::steady_clock::now();
 
-    std::cout << "LEFT: " << cmd.left
-              << " | RIGHT: " << cmd.right << std::endl;
+    while (true) {
+        BBoxMsg msg;
+        std::chrono::steady_clock::time_point received;
+        uint32_t dropped;
+        {
+            std::unique_lock<std::mutex> lock(latest.m);
+            latest.cv.wait(lock, [&] { return latest.fresh || latest.closed; });
+            if (!latest.fresh) {
+                std::cerr << "[WARN] Input stream closed. Exiting.\n";
+                break;
+            }
+            msg          = latest.msg;
+            received     = latest.received;
+            dropped      = latest.dropped;
+            latest.fresh = false;
+        }
 
-    std::this_thread::sleep_for(
-        std::chrono::milliseconds(1000 / CONTROL_HZ)
-    );
-}
+        MotorCmd cmd = {0.0f, 0.0f};
+        if (!(msg.flags & FLAG_STOP) && msg.w > 0 && msg.h > 0) {
+            BBox bbox = {msg.x, msg.y, msg.w, msg.h, msg.vx, msg.vy};
+            // senders that do not declare a geometry use the reference one
+            float frame_w = msg.frame_w ? msg.frame_w : REF_FRAME_WIDTH;
+            float frame_h = msg.frame_h ? msg.frame_h : REF_FRAME_HEIGHT;
+            cmd = compute_control(bbox, reference_area, frame_w, frame_h);
+        }
+
+        CmdMsg reply;
+        reply.magic   = CMD_MAGIC;
+        reply.seq     = msg.seq;
+        reply.t_echo  = msg.t_sent;
+        reply.left    = cmd.left;
+        reply.right   = cmd.right;
+        reply.dropped = dropped;
+        reply.loop_us = std::chrono::duration<float, std::micro>(
+            std::chrono::steady_clock::now() - received
+        ).count();
+
+        if (!write_exact(out_fd, &reply, sizeof(reply))) {
+            std::cerr << "[WARN] Output stream closed. Exiting.\n";
+            break;
+        }
+
+        // rate-limit the control loop; boxes arriving meanwhile replace each other
+        next_tick += period;
+        std::this_thread::sleep_until(next_tick);
+        if (std::chrono::steady_clock::now() > next_tick + period) {
+            next_tick = std::chrono::steady_clock::now();
+        }
+    }
+
+    // the reader may still be blocked in read() — process exit tears it down
+    reader.detach();
     return 0;
-}
\ No newline at end of file
+}
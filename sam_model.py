@@ -1,18 +1,207 @@
+import os
 import cv2
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import torch
-from segment_anything import sam_model_registry, SamPredictor
 from PIL import Image
+from utils.model_registry import registry
 
 sam_checkpoint = "models/sam_vit_b_01ec64.pth"
 model_type = "vit_b"
 device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
 
-sam = sam_model_registry[model_type](checkpoint=sam_checkpoint).to(device)
-predictor = SamPredictor(sam)
+# --- Lazy SAM loading (first use or registry.prefetch) ---
+def _load_sam():
+    from segment_anything import sam_model_registry, SamPredictor
+    sam = sam_model_registry[model_type](checkpoint=sam_checkpoint).to(device)
+    return SamPredictor(sam)
 
-def call_sam(frame: np.ndarray,box):
-    predictor.set_image(frame)
+registry.register("sam", _load_sam)
+
+def get_predictor():
+    return registry.get("sam")
+
+# --- Mask decoder backend ---
+# "torch" : SamPredictor end to end
+# "onnx"  : image embedding from the (cached) PyTorch encoder, prompt
+#           encoder + mask decoder through ONNX Runtime on CPU — a few ms
+#           per prompt, no GPU needed for click / box refinement
+# Process-wide default set with set_sam_backend() (the segmentation
+# service does this in its worker); call_sam / call_sam_batch /
+# segment_points also take backend= per call.
+SAM_BACKENDS = ("torch", "onnx")
+SAM_BACKEND = "torch"
+SAM_DECODER_ONNX = f"models/onnx_cache/sam_{model_type}_decoder.onnx"
+SAM_DECODER_OPSET = 17
+
+def set_sam_backend(backend: str):
+    global SAM_BACKEND
+    if backend not in SAM_BACKENDS:
+        raise ValueError(f"Unknown SAM backend '{backend}' — expected one of {SAM_BACKENDS}")
+    SAM_BACKEND = backend
+
+def _use_onnx(backend):
+    backend = backend or SAM_BACKEND
+    if backend not in SAM_BACKENDS:
+        raise ValueError(f"Unknown SAM backend '{backend}' — expected one of {SAM_BACKENDS}")
+    return backend == "onnx"
+
+def export_sam_decoder(path: str = SAM_DECODER_ONNX) -> str:
+    """
+    Exports prompt encoder + mask decoder (SamOnnxModel). The graph returns
+    the 256x256 low-res logits of all mask tokens; _decode_onnx takes the
+    first (like multimask_output=False) and upscales it.
+    """
+    from segment_anything.utils.onnx import SamOnnxModel
+
+    class _LowResSamOnnxModel(SamOnnxModel):
+        # tracing turns the crop to the pre-padded size into constants of
+        # the dummy orig_im_size — upscaling happens outside the graph
+        def mask_postprocessing(self, masks, orig_im_size):
+            return masks
+
+    sam = get_predictor().model
+    onnx_model = _LowResSamOnnxModel(sam, return_single_mask=False).cpu().eval()
+    embed_dim  = sam.prompt_encoder.embed_dim
+    embed_size = sam.prompt_encoder.image_embedding_size
+    mask_size  = [4 * x for x in embed_size]
+    dummy = {
+        "image_embeddings": torch.randn(1, embed_dim, *embed_size, dtype=torch.float),
+        "point_coords"    : torch.randint(low=0, high=1024, size=(1, 5, 2), dtype=torch.float),
+        "point_labels"    : torch.randint(low=0, high=4, size=(1, 5), dtype=torch.float),
+        "mask_input"      : torch.randn(1, 1, *mask_size, dtype=torch.float),
+        "has_mask_input"  : torch.tensor([1], dtype=torch.float),
+        "orig_im_size"    : torch.tensor([512, 512], dtype=torch.float),
+    }
+
+    print(f"[INFO] Exporting SAM mask decoder → '{path}' ...")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            onnx_model,
+            tuple(dummy.values()),
+            tmp,
+            input_names=list(dummy.keys()),
+            output_names=["masks", "iou_predictions", "low_res_masks"],
+            dynamic_axes={
+                "point_coords": {0: "num_prompts", 1: "num_points"},
+                "point_labels": {0: "num_prompts", 1: "num_points"},
+            },
+            opset_version=SAM_DECODER_OPSET,
+            do_constant_folding=True,
+            dynamo=False,
+        )
+    os.replace(tmp, path)
+    return path
+
+def _load_sam_decoder():
+    import onnxruntime as ort
+    if not os.path.exists(SAM_DECODER_ONNX):
+        export_sam_decoder(SAM_DECODER_ONNX)
+    return ort.InferenceSession(SAM_DECODER_ONNX, providers=["CPUExecutionProvider"])
+
+registry.register("sam_decoder_onnx", _load_sam_decoder)
+
+_onnx_embedding = (None, None)   # (frame digest, numpy image embedding) of the last ONNX decode
+
+def _decode_onnx(frame: np.ndarray, point_coords: np.ndarray, point_labels: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        point_coords : (B, N, 2) in frame pixels
+        point_labels : (B, N) — 1 fg, 0 bg, 2/3 box corners, -1 padding
+    Returns:
+        (B, H, W) uint8 masks
+    """
+    global _onnx_embedding
+    session = registry.get("sam_decoder_onnx")
+    predictor = get_predictor()
+
+    key = set_image_cached(frame)
+    if _onnx_embedding[0] != key:
+        _onnx_embedding = (key, predictor.features.float().cpu().numpy())
+
+    h, w = frame.shape[:2]
+    coords = predictor.transform.apply_coords(np.asarray(point_coords, dtype=np.float32), (h, w))
+    embed_size = predictor.model.prompt_encoder.image_embedding_size
+    feed = {
+        "image_embeddings": _onnx_embedding[1],
+        "point_coords"    : coords.astype(np.float32),
+        "point_labels"    : np.asarray(point_labels, dtype=np.float32),
+        "mask_input"      : np.zeros((1, 1, 4 * embed_size[0], 4 * embed_size[1]), np.float32),
+        "has_mask_input"  : np.zeros(1, np.float32),
+        "orig_im_size"    : np.array((h, w), np.float32),
+    }
+    inputs = {i.name for i in session.get_inputs()}   # unused inputs are pruned at export
+    low_res = session.run(["masks"], {k: v for k, v in feed.items() if k in inputs})[0][:, 0]
+
+    # same as Sam.postprocess_masks: → encoder input size, drop padding, → frame size
+    img_size = predictor.model.image_encoder.img_size
+    input_h, input_w = predictor.transform.get_preprocess_shape(h, w, img_size)
+    masks = np.empty((len(low_res), h, w), np.uint8)
+    for i, logits in enumerate(low_res):
+        logits = cv2.resize(logits, (img_size, img_size), interpolation=cv2.INTER_LINEAR)
+        logits = cv2.resize(logits[:input_h, :input_w], (w, h), interpolation=cv2.INTER_LINEAR)
+        masks[i] = logits > predictor.model.mask_threshold
+    return masks
+
+# --- Image embedding cache ---
+# set_image() runs the ViT encoder; repeat prompts on the same frame
+# (retries, switching text / image / click) only need the mask decoder.
+EMBED_CACHE_MAX_BYTES = 64 * 1024 * 1024   # vit_b embedding ≈ 4 MB
+_embed_cache = OrderedDict()               # digest → (features, original_size, input_size)
+_embed_cache_bytes = 0
+_current_digest = None
+
+def frame_digest(frame: np.ndarray) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{frame.shape}{frame.dtype}".encode())
+    h.update(np.ascontiguousarray(frame).data)
+    return h.hexdigest()
+
+def set_image_cached(frame: np.ndarray) -> str:
+    """predictor.set_image() with an LRU cache of image embeddings."""
+    global _embed_cache_bytes, _current_digest
+
+    predictor = get_predictor()
+    key = frame_digest(frame)
+    if key == _current_digest and predictor.is_image_set:
+        return key
+
+    entry = _embed_cache.get(key)
+    if entry is not None:
+        _embed_cache.move_to_end(key)
+        predictor.features, predictor.original_size, predictor.input_size = entry
+        predictor.is_image_set = True
+    else:
+        predictor.set_image(frame)
+        _embed_cache[key] = (predictor.features, predictor.original_size, predictor.input_size)
+        _embed_cache_bytes += predictor.features.numel() * predictor.features.element_size()
+
+        # evict least recently used, always keep the newest entry
+        while _embed_cache_bytes > EMBED_CACHE_MAX_BYTES and len(_embed_cache) > 1:
+            _, (features, _, _) = _embed_cache.popitem(last=False)
+            _embed_cache_bytes -= features.numel() * features.element_size()
+
+    _current_digest = key
+    return key
+
+def clear_embedding_cache():
+    global _embed_cache_bytes, _current_digest
+    _embed_cache.clear()
+    _embed_cache_bytes = 0
+    _current_digest = None
+    if registry.is_loaded("sam"):
+        get_predictor().reset_image()
+
+def call_sam(frame: np.ndarray,box, backend: str = None):
+    if _use_onnx(backend):
+        return _decode_onnx(frame, np.reshape(box, (1, 2, 2)), [[2, 3]])[0]
+
+    predictor = get_predictor()
+    set_image_cached(frame)
     with torch.no_grad():
         masks, scores, logits = predictor.predict(
             box=box[None, :],   # shape [1, 4]
@@ -21,31 +210,83 @@ def call_sam(frame: np.ndarray,box):
     best_mask = masks[0].astype(np.uint8)
     return best_mask
 
+def call_sam_batch(frame: np.ndarray, boxes, backend: str = None):
+    """
+    One mask per xyxy box, all decoded in a single batched pass.
+    backend: "torch" / "onnx", None → SAM_BACKEND
+    Returns:
+        (N, H, W) uint8
+    """
+    if _use_onnx(backend):
+        boxes = np.reshape(boxes, (-1, 2, 2))
+        return _decode_onnx(frame, boxes, np.tile([[2, 3]], (len(boxes), 1)))
+
+    predictor = get_predictor()
+    set_image_cached(frame)
+    boxes = torch.as_tensor(np.asarray(boxes), dtype=torch.float, device=predictor.device)
+    boxes = predictor.transform.apply_boxes_torch(boxes, frame.shape[:2])
+    with torch.no_grad():
+        masks, scores, logits = predictor.predict_torch(
+            point_coords=None,
+            point_labels=None,
+            boxes=boxes,
+            multimask_output=False
+        )
+    return masks[:, 0].cpu().numpy().astype(np.uint8)
+
 # --- Segment on click ---
-def segment_on_click(frame_rgb, max_clicks):
+CLICK_WINDOW = "Click to Segment"
+
+def collect_clicks(frame_rgb, max_clicks, ui=None):
+    """
+    Shows the frame and returns max_clicks clicked (x, y) points.
+    ui: running Visualizer — the window and its mouse callback live on
+        its thread (HighGUI is not thread-safe) while this thread waits;
+        None → HighGUI is driven from this thread
+    """
     coords = []
-    frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
-    clone = frame_bgr.copy()
+    if max_clicks <= 0:
+        return coords
+    clone = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+    done = threading.Event()
 
     def click_event(event, x, y, flags, param):
         if event == cv2.EVENT_LBUTTONDOWN and len(coords) < max_clicks:
             coords.append((x, y))
             cv2.circle(param, (x, y), 6, (0, 0, 255), -1)
-            cv2.imshow("Click to Segment", param)
+            cv2.imshow(CLICK_WINDOW, param)
+            if len(coords) == max_clicks:
+                done.set()
 
-    cv2.imshow("Click to Segment", clone)
-    cv2.setMouseCallback("Click to Segment", click_event, clone)
+    def open_window():
+        cv2.imshow(CLICK_WINDOW, clone)
+        cv2.setMouseCallback(CLICK_WINDOW, click_event, clone)
 
-    while True:
-        cv2.imshow("Click to Segment", clone)
-        key = cv2.waitKey(1) & 0xFF
+    if ui is None:
+        open_window()
+        while not done.is_set():
+            cv2.waitKey(1)
+        cv2.destroyWindow(CLICK_WINDOW)
+        return coords
 
-        if len(coords) == max_clicks:
-            break
+    ui.call(open_window).result()
+    while not done.wait(0.1):
+        if not ui.running:
+            raise RuntimeError("Display closed while waiting for clicks")
+    ui.call(cv2.destroyWindow, CLICK_WINDOW).result()
+    return coords
 
-    cv2.destroyAllWindows()
+def segment_points(frame_rgb, coords, backend: str = None):
+    """Mask of the object under the foreground points coords [(x, y), ...]."""
+    coords = list(coords)
+    if _use_onnx(backend):
+        # no box prompt → one padding point, as in SAM's ONNX example
+        coords = np.array(coords + [(0, 0)], dtype=np.float32)[None]
+        labels = np.array([1] * (len(coords[0]) - 1) + [-1], dtype=np.float32)[None]
+        return _decode_onnx(frame_rgb, coords, labels)[0]
 
-    predictor.set_image(frame_rgb)
+    predictor = get_predictor()
+    set_image_cached(frame_rgb)
     point_labels = np.ones(len(coords), dtype=int)
 
     with torch.no_grad():
@@ -57,3 +298,6 @@ def segment_on_click(frame_rgb, max_clicks):
 
     best_mask = masks[0].astype(np.uint8)
     return best_mask
+
+def segment_on_click(frame_rgb, max_clicks):
+    return segment_points(frame_rgb, collect_clicks(frame_rgb, max_clicks))
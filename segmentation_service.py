@@ -0,0 +1,333 @@
+import queue
+import threading
+import multiprocessing as mp
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from utils.mask_analysis import mask_stats, RLEMask
+
+SegmentationResult = namedtuple("SegmentationResult", ["mask", "box", "area", "score"])
+
+MAX_PROMPTS = 32   # prompts the worker keeps at most — the least recently used is forgotten
+
+
+# ---------------------------------------------------------------
+# SHARED-MEMORY FRAME RING
+# ---------------------------------------------------------------
+class FrameRing:
+    """
+    `slots` fixed-size uint8 frame slots in one shared-memory block.
+    The client writes a frame into a free slot (the only copy, fused with
+    the BGR → RGB conversion); the worker maps the same bytes as an ndarray
+    without copying. Slot ownership is tracked by SegmentationService.
+    """
+    def __init__(self, slots, slot_bytes, name=None):
+        """
+        Args:
+            slots      : number of frames in flight at most
+            slot_bytes : bytes per slot (H * W * 3 of the largest frame)
+            name       : None → create the block, else attach to it
+        """
+        self.slots      = slots
+        self.slot_bytes = slot_bytes
+        self.owner      = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    def view(self, slot, shape):
+        """HxWx3 uint8 array backed by the slot — no copy."""
+        if int(np.prod(shape)) > self.slot_bytes:
+            raise ValueError(f"Frame {shape} does not fit a {self.slot_bytes}-byte ring slot")
+        return np.ndarray(shape, np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def put_bgr(self, slot, frame):
+        """Stores a BGR frame as RGB (what SAM / CLIPSeg expect)."""
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.view(slot, frame.shape))
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ---------------------------------------------------------------
+# WORKER PROCESS
+# ---------------------------------------------------------------
+def _segmentation_worker(ring_name, slot_bytes, slots, requests, results, prompt_cache, sam_backend):
+    # SAM and CLIPSeg live only here — the tracking process never holds the
+    # GIL or the device for segmentation
+    ring = FrameRing(slots, slot_bytes, name=ring_name)
+    try:
+        from clipseg import clipping, load_prompt_cache, save_prompt_cache
+        from sam_model import call_sam, segment_points, set_sam_backend
+        from utils.model_registry import registry
+
+        if prompt_cache:
+            load_prompt_cache(prompt_cache)
+        registry.get("clipseg")
+        set_sam_backend(sam_backend)   # also used by CLIPSeg's SAM refinement
+        registry.get("sam")
+        if sam_backend == "onnx":
+            registry.get("sam_decoder_onnx")
+    except Exception as e:   # report it — the client would otherwise wait for 'ready' forever
+        results.put(('ready', None, None, 0, 0.0, repr(e)))
+        ring.close()
+        return
+    results.put(('ready', None, None, 0, 0.0, None))
+
+    prompts = {}   # prompt id → Prompt, sent once per prompt
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        if job[0] == 'prompt':
+            _, prompt_id, prompt = job
+            prompts[prompt_id] = prompt
+            continue
+        if job[0] == 'forget':
+            prompts.pop(job[1], None)
+            continue
+
+        req_id, slot, shape, kind, arg, return_mask = job
+        frame = ring.view(slot, shape)
+        try:
+            if kind == 'prompt':
+                prompt = prompts[arg]
+                mask, score = clipping(frame, ref_image=prompt.ref_image, text=prompt.text, return_score=True)
+            elif kind == 'box':
+                x, y, w, h = arg
+                mask, score = call_sam(frame, np.array([x, y, x + w, y + h])), 1.0
+            else:
+                mask, score = segment_points(frame, arg), 1.0
+            stats = mask_stats(mask)
+            # masks travel run-length encoded: ~1 KB instead of H*W bytes
+            reply = (
+                req_id,
+                RLEMask.encode(mask) if return_mask else None,
+                stats.box if stats else None,
+                stats.area if stats else 0,
+                float(score),
+                None,
+            )
+        except Exception as e:   # keep the worker alive — the caller's future gets the error
+            reply = (req_id, None, None, 0, 0.0, repr(e))
+        frame = None   # no view may outlive the slot
+        results.put(reply)
+
+    if prompt_cache:
+        save_prompt_cache(prompt_cache)
+    ring.close()
+
+
+# ---------------------------------------------------------------
+# SEGMENTATION SERVICE
+# ---------------------------------------------------------------
+class SegmentationService:
+    """
+    Long-lived segmentation process: SAM and CLIPSeg are loaded once, in
+    the worker. Requests are non-blocking and return futures:
+        service = SegmentationService().start()
+        future  = service.segment(frame, prompt=Prompt(text="backpack"))
+        ...                                  # keep tracking meanwhile
+        mask, box, area, score = future.result()
+    Frames go through a shared-memory ring and masks come back
+    run-length encoded, so only small messages are pickled. The worker uses the 'spawn' start
+    method (CUDA-safe), so the calling script needs an
+    `if __name__ == "__main__":` guard.
+    """
+    def __init__(self, max_frame_shape=(1080, 1920), slots=4, prompt_cache=None, sam_backend="torch"):
+        """
+        Args:
+            max_frame_shape : (H, W) of the largest frame that will be sent
+            slots           : requests in flight at most
+            prompt_cache    : CLIPSeg prompt cache file the worker loads at
+                              start and saves at stop (None = off)
+            sam_backend     : SAM mask decoder in the worker — "torch" or
+                              "onnx" (sam_model.SAM_BACKENDS)
+        """
+        self.ring = FrameRing(slots, max_frame_shape[0] * max_frame_shape[1] * 3)
+
+        ctx = mp.get_context('spawn')
+        self.requests = ctx.Queue()
+        self.results  = ctx.Queue()
+        self.proc = ctx.Process(
+            target=_segmentation_worker,
+            args=(self.ring.name, self.ring.slot_bytes, slots, self.requests, self.results, prompt_cache,
+                  sam_backend),
+            name="Segmentation",
+            daemon=True,
+        )
+
+        self.lock       = threading.Lock()
+        self.slot_free  = threading.Condition(self.lock)
+        self.free_slots = deque(range(slots))
+        self.futures    = {}   # req_id → (Future, slot)
+        self.prompt_ids = OrderedDict()   # id(prompt) → prompt already sent to the worker, LRU order
+        self.req_id     = 0
+        self.ready      = threading.Event()
+        self.error      = None   # set if the worker failed to start or died
+        self.stopping   = False
+        self.collector  = threading.Thread(target=self._collect, name="SegmentationResults", daemon=True)
+
+    def start(self):
+        self.proc.start()
+        self.collector.start()
+        print("[INFO] Segmentation service started")
+        return self
+
+    def wait_ready(self, timeout=None):
+        """Blocks until the worker has loaded its models; raises RuntimeError if it failed to or died."""
+        ready = self.ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return ready
+
+    def segment(self, frame, prompt=None, box=None, points=None, return_mask=True, block=True):
+        """
+        Queues one segmentation of a BGR frame. Exactly one of
+            prompt : redetect.Prompt — CLIPSeg, refined by SAM
+            box    : (x, y, w, h) — SAM box prompt
+            points : [(x, y), ...] foreground clicks — SAM point prompt
+        Args:
+            return_mask : False → only the box comes back (less to pickle)
+            block       : False → return None instead of waiting when all
+                          ring slots are in flight
+        Returns:
+            Future → SegmentationResult(mask or None, box (x, y, w, h) and
+            area of the largest component — None / 0 if nothing was found —
+            score); raises RuntimeError if the worker failed or died
+        """
+        if sum(a is not None for a in (prompt, box, points)) != 1:
+            raise ValueError("segment() needs exactly one of prompt / box / points")
+        if frame.ndim != 3 or frame.shape[2] != 3 or frame.dtype != np.uint8:
+            raise ValueError(f"segment() needs an HxWx3 uint8 BGR frame, got {frame.shape} {frame.dtype}")
+        if frame.size > self.ring.slot_bytes:
+            raise ValueError(f"Frame {frame.shape} is larger than max_frame_shape allows")
+
+        with self.slot_free:
+            if self.error is not None:
+                raise self.error
+            if not self.slot_free.wait_for(lambda: self.free_slots or self.error is not None,
+                                           timeout=None if block else 0):
+                return None
+            if self.error is not None:   # the worker died while we waited
+                raise self.error
+            slot = self.free_slots.popleft()
+            self.req_id += 1
+            req_id = self.req_id
+            future = Future()
+            self.futures[req_id] = (future, slot)
+
+        try:
+            self.ring.put_bgr(slot, frame)
+            if prompt is not None:
+                kind, arg = 'prompt', id(prompt)
+            elif box is not None:
+                kind, arg = 'box', tuple(int(v) for v in box)
+            else:
+                kind, arg = 'points', [(float(x), float(y)) for x, y in points]
+            # one lock around the prompt and the job: another caller can't
+            # evict the prompt between the two
+            with self.lock:
+                if prompt is not None:
+                    self._send_prompt(prompt)
+                self.requests.put((req_id, slot, frame.shape, kind, arg, return_mask))
+        except BaseException:   # nothing was queued — hand the slot back
+            with self.slot_free:
+                self.futures.pop(req_id, None)
+                self.free_slots.append(slot)
+                self.slot_free.notify()
+            raise
+        return future
+
+    def _send_prompt(self, prompt):
+        # caller holds self.lock. Requests are handled in order, so a prompt
+        # reaches the worker before the jobs that use it and is forgotten
+        # only after them
+        if id(prompt) in self.prompt_ids:
+            self.prompt_ids.move_to_end(id(prompt))
+            return
+        self.prompt_ids[id(prompt)] = prompt   # keeps id() from being reused
+        self.requests.put(('prompt', id(prompt), prompt))
+        while len(self.prompt_ids) > MAX_PROMPTS:
+            old_id, _ = self.prompt_ids.popitem(last=False)
+            self.requests.put(('forget', old_id))
+
+    def forget_prompt(self, prompt):
+        """Drops a prompt from the worker (e.g. the target changed); it is re-sent if used again."""
+        with self.lock:
+            if self.prompt_ids.pop(id(prompt), None) is not None:
+                self.requests.put(('forget', id(prompt)))
+
+    def _fail(self, message):
+        """The worker is gone: requests in flight and every later call get the error."""
+        print(f"[ERROR] {message}")
+        with self.lock:
+            self.error = RuntimeError(message)
+            failed = [future for future, _ in self.futures.values()]
+            self.futures.clear()
+            self.slot_free.notify_all()   # wake segment() calls waiting for a slot
+        for future in failed:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(self.error)
+        self.ready.set()
+
+    def _collect(self):
+        while True:
+            try:
+                item = self.results.get(timeout=0.5)
+            except queue.Empty:
+                # replies already queued are drained first; an empty queue
+                # and a dead worker is the end — after stop(), or a crash
+                # (OOM killer, segfault in a native op) otherwise
+                if self.proc.is_alive():
+                    continue
+                if not self.stopping and self.error is None:
+                    self._fail(f"Segmentation worker exited unexpectedly (exit code {self.proc.exitcode})")
+                break
+            req_id, rle, box, area, score, error = item
+            if req_id == 'ready':
+                if error is not None:
+                    self._fail(f"Segmentation worker failed to start: {error}")
+                self.ready.set()
+                continue
+
+            with self.slot_free:
+                future, slot = self.futures.pop(req_id)
+                self.free_slots.append(slot)
+                self.slot_free.notify()
+            if not future.set_running_or_notify_cancel():
+                continue   # cancelled by the caller
+            if error is not None:
+                future.set_exception(RuntimeError(f"Segmentation failed: {error}"))
+            else:
+                mask = rle.decode() if rle is not None else None
+                future.set_result(SegmentationResult(mask, box, area, score))
+
+    def stop(self):
+        self.stopping = True
+        if self.proc.is_alive():
+            self.requests.put(None)
+            self.proc.join(timeout=5.0)   # the worker saves the prompt cache on the way out
+            if self.proc.is_alive():
+                self.proc.terminate()
+        self.collector.join(timeout=2.0)   # exits once the worker has and its replies are drained
+        with self.lock:
+            for future, _ in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+        self.ring.close()
+        print("[INFO] Segmentation service stopped")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,133 @@
+import struct
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# --- Mask statistics ---
+# box / area / centroid describe the largest connected component (what the
+# tracker, the preview and re-detection all key on, so they agree);
+# tight_box / total_area cover every foreground pixel.
+# Boxes follow cv2.boundingRect: (x, y, w, h) with w / h the extent in
+# pixels, so x + w is one past the last foreground column. Use box_xyxy()
+# for inclusive corner coordinates (first / last foreground pixel).
+MaskStats = namedtuple(
+    "MaskStats",
+    ["box", "area", "centroid", "tight_box", "total_area", "n_components"]
+)
+
+
+def as_binary_u8(mask: np.ndarray) -> np.ndarray:
+    """HxW uint8, nonzero = object. uint8 masks pass through, bool is viewed without a copy."""
+    if mask.ndim == 3:
+        mask = mask[..., 0]
+    if mask.dtype == np.uint8:
+        return mask
+    if mask.dtype != bool:
+        mask = mask > 0
+    return np.ascontiguousarray(mask).view(np.uint8)
+
+
+def mask_stats(mask: np.ndarray, min_area: int = 1):
+    """
+    Largest-component box / area / centroid plus the tight box of the whole
+    mask. cv2.boundingRect finds the foreground extent first (a fast SIMD
+    scan), then a single connected-components pass (8-connectivity, BBDT)
+    runs on that region only — objects rarely cover the whole frame.
+    Args:
+        mask     : HxW, nonzero / True = object pixels
+        min_area : largest component smaller than this → None
+    Returns:
+        MaskStats with boxes as (x, y, w, h) ints, or None if the mask has
+        no component of min_area pixels
+    """
+    m = as_binary_u8(mask)
+    x0, y0, w0, h0 = cv2.boundingRect(m)
+    if w0 == 0:
+        return None
+
+    n, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+        m[y0:y0 + h0, x0:x0 + w0], 8, cv2.CV_32S, cv2.CCL_BBDT
+    )
+    comps = stats[1:]   # label 0 is the background
+    k = int(np.argmax(comps[:, cv2.CC_STAT_AREA]))
+    x, y, w, h, area = (int(v) for v in comps[k])
+    if area < min_area:
+        return None
+
+    cx, cy = centroids[k + 1]
+    return MaskStats(
+        box=(x0 + x, y0 + y, w, h),
+        area=area,
+        centroid=(float(x0 + cx), float(y0 + cy)),
+        tight_box=(x0, y0, w0, h0),
+        total_area=int(comps[:, cv2.CC_STAT_AREA].sum()),
+        n_components=n - 1,
+    )
+
+
+def mask_box(mask: np.ndarray, min_area: int = 1):
+    """(x, y, w, h) of the largest component (w / h in px), or None."""
+    stats = mask_stats(mask, min_area)
+    return stats.box if stats is not None else None
+
+
+def box_xyxy(box):
+    """(x, y, w, h) → inclusive corners (x0, y0, x1, y1) of the first / last pixel."""
+    x, y, w, h = box
+    return x, y, x + w - 1, y + h - 1
+
+
+# --- Run-length encoded masks ---
+class RLEMask:
+    """
+    Binary mask as row-major run lengths, alternating background /
+    foreground and starting with background (a leading 0 run if the first
+    pixel is set). Object masks are a few hundred runs instead of H*W
+    bytes — used to pass masks between processes and off the rover.
+    """
+    __slots__ = ("shape", "counts")
+
+    _HEADER = struct.Struct("<HHB")   # height, width, bytes per count
+
+    def __init__(self, shape, counts):
+        self.shape  = (int(shape[0]), int(shape[1]))
+        self.counts = counts
+
+    @classmethod
+    def encode(cls, mask: np.ndarray) -> "RLEMask":
+        flat = as_binary_u8(mask).ravel() > 0
+        # run boundaries: every index where the value changes
+        edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        counts = np.diff(np.concatenate(([0], edges, [flat.size])))
+        if flat.size and flat[0]:
+            counts = np.concatenate(([0], counts))
+        dtype = np.uint16 if counts.max(initial=0) <= 0xFFFF else np.uint32
+        return cls(mask.shape[:2], counts.astype(dtype))
+
+    def decode(self) -> np.ndarray:
+        """HxW uint8 mask (0 / 1)."""
+        values = (np.arange(len(self.counts)) & 1).astype(np.uint8)
+        return np.repeat(values, self.counts.astype(np.intp)).reshape(self.shape)
+
+    @property
+    def area(self) -> int:
+        return int(self.counts[1::2].sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self._HEADER.size + self.counts.nbytes
+
+    def to_bytes(self) -> bytes:
+        """Little-endian: height, width (uint16), count width (uint8), counts."""
+        counts = self.counts.astype(self.counts.dtype.newbyteorder("<"), copy=False)
+        return self._HEADER.pack(self.shape[0], self.shape[1], counts.itemsize) + counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RLEMask":
+        h, w, itemsize = cls._HEADER.unpack_from(data)
+        dtype = np.dtype("<u2" if itemsize == 2 else "<u4")
+        return cls((h, w), np.frombuffer(data, dtype, offset=cls._HEADER.size))
+
+    def __repr__(self):
+        return f"RLEMask({self.shape[1]}x{self.shape[0]}, {len(self.counts)} runs, {self.nbytes} bytes)"
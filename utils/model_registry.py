@@ -0,0 +1,70 @@
+import time
+import threading
+
+
+class ModelRegistry:
+    """
+    Loads each registered model on first use instead of at import time.
+    prefetch() can warm models up on a background thread (e.g. while the
+    camera starts); get() then returns immediately or waits for that load.
+    """
+    def __init__(self):
+        self._loaders    = {}
+        self._models     = {}
+        self._locks      = {}
+        self.load_times  = {}   # name → seconds spent in the loader
+
+    def register(self, name, loader):
+        """
+        Args:
+            name   : key used with get()
+            loader : zero-arg callable returning the loaded model (any object)
+        """
+        self._loaders[name] = loader
+        self._locks[name]   = threading.Lock()
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        if name in self._models:
+            return self._models[name]
+        if name not in self._loaders:
+            raise KeyError(f"No model registered as '{name}'")
+
+        # one loader run per model, even if prefetch and get() race
+        with self._locks[name]:
+            if name not in self._models:
+                t0 = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self.load_times[name] = time.perf_counter() - t0
+                print(f"[INFO] Model '{name}' loaded in {self.load_times[name]:.2f}s")
+        return self._models[name]
+
+    def prefetch(self, names=None):
+        """
+        Loads models in order on a daemon thread. Failures are only
+        reported here; get() retries the load and raises.
+        """
+        names = list(self._loaders) if names is None else list(names)
+
+        def _worker():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"[WARN] Prefetch of '{name}' failed: {e}")
+
+        thread = threading.Thread(target=_worker, name="ModelPrefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self):
+        for name in self._loaders:
+            if name in self.load_times:
+                print(f"[INFO] {name:<10} loaded in {self.load_times[name]:.2f}s")
+            else:
+                print(f"[INFO] {name:<10} not loaded")
+
+
+registry = ModelRegistry()
@@ -0,0 +1,73 @@
+import os
+import json
+from collections import namedtuple
+
+import cv2
+
+# --- Prompt sidecar: the initial prompt of a recording, for replays ---
+# <source>.prompt.json, exactly one of box / text / image / clicks:
+#   {"frame": 0, "box": [x, y, w, h]}
+#   {"frame": 0, "text": "red backpack"}
+#   {"frame": 0, "image": "backpack.png"}        (relative to the sidecar)
+#   {"frame": 0, "clicks": [[x, y], [x, y]]}
+# Coordinates are in the recording's native resolution; "frame" is the
+# index of the frame the prompt applies to (default 0).
+PROMPT_KINDS = ("box", "text", "image", "clicks")
+
+PromptSpec = namedtuple("PromptSpec", ["kind", "value", "frame"])
+
+
+def sidecar_path(source) -> str:
+    """Default sidecar next to a recording, None for cameras."""
+    if not isinstance(source, str) or source.isdigit():
+        return None
+    return source.rstrip("/\\") + ".prompt.json"
+
+
+def load_prompt_sidecar(path: str) -> PromptSpec:
+    """
+    Returns:
+        PromptSpec — value is (x, y, w, h) for box, the string for text,
+        an RGB array for image and a list of (x, y) for clicks
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    kinds = [k for k in PROMPT_KINDS if k in data]
+    if len(kinds) != 1:
+        raise ValueError(f"'{path}' needs exactly one of {', '.join(PROMPT_KINDS)}")
+    kind, value = kinds[0], data[kinds[0]]
+
+    if kind == "box":
+        if len(value) != 4:
+            raise ValueError(f"'{path}': box must be [x, y, w, h]")
+        value = tuple(int(v) for v in value)
+    elif kind == "image":
+        image_path = os.path.join(os.path.dirname(os.path.abspath(path)), value)
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"'{path}': cannot read reference image '{image_path}'")
+        value = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    elif kind == "clicks":
+        value = [(int(x), int(y)) for x, y in value]
+
+    return PromptSpec(kind, value, int(data.get("frame", 0)))
+
+
+def save_prompt_sidecar(path: str, kind: str, value, frame: int = 0):
+    """
+    kind / value as in the file format (image: a path, stored relative to
+    the sidecar when possible).
+    """
+    if kind not in PROMPT_KINDS:
+        raise ValueError(f"Unknown prompt kind: {kind}")
+    if kind == "image":
+        value = os.path.relpath(os.path.abspath(value), os.path.dirname(os.path.abspath(path)))
+    elif kind == "box":
+        value = [int(v) for v in value]
+    elif kind == "clicks":
+        value = [[int(x), int(y)] for x, y in value]
+
+    with open(path, "w") as f:
+        json.dump({"frame": frame, kind: value}, f, indent=2)
+    print(f"[INFO] Prompt saved → '{path}'")